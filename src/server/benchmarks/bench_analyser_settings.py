@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS ANALYSER SETTINGS BENCHMARK
+
+Measures the CPU cost of Yin and Centroid on an offline server for the
+block sizes, decimation factors and prefilters that can be set per
+analyser in the sigproc section of hans-config.json, and reports the CPU
+saved against the default setting along with the analysis window.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+from functools import partial
+
+from offline import measure
+
+SR = 44100
+
+VARIANTS = {
+    'yin': [{'winsize': 1024},
+            {'winsize': 512},
+            {'winsize': 2048},
+            {'winsize': 1024, 'downsample': 2},
+            {'winsize': 512, 'downsample': 4, 'lowpass': 2000}],
+    'cen': [{'size': 1024},
+            {'size': 512},
+            {'size': 4096},
+            {'size': 1024, 'downsample': 2},
+            {'size': 512, 'downsample': 4, 'lowpass': 4000}],
+}
+
+
+def build(name, settings, server, source):
+    import pyo
+    from lib.analysers import build_analyser
+    module = {'yin': pyo.Yin, 'cen': pyo.Centroid}[name]
+    return build_analyser(module, source, **settings)
+
+
+def idle(server, source):
+    return []
+
+
+def window_ms(settings):
+    # audio covered by one analysis window
+    size = settings.get('winsize', settings.get('size'))
+    return 1000 * size * settings.get('downsample', 1) / SR
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='HANS analyser settings benchmark')
+    parser.add_argument('-d', '--duration', type=float, default=20.0,
+                        help='Seconds of audio to render per variant')
+    args = parser.parse_args()
+
+    # the source signal alone, subtracted from every variant
+    base = measure(idle, args.duration, SR)
+    print(f"{'analyser':<8} {'settings':<44} {'cpu %':>7} "
+          f"{'saved %':>8} {'window ms':>10}")
+    for name, variants in VARIANTS.items():
+        reference = None
+        for settings in variants:
+            elapsed = measure(partial(build, name, settings),
+                              args.duration, SR) - base
+            reference = reference or elapsed
+            print(f'{name:<8} {str(settings):<44} '
+                  f'{100 * elapsed / args.duration:>7.2f} '
+                  f'{100 * (1 - elapsed / reference):>8.1f} '
+                  f'{window_ms(settings):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
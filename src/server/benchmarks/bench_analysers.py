@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS ANALYSER BENCHMARK
+
+Compares the CPU cost of the SigProc analysers on an offline server:
+the stock per-analyser setup, spectral features added one analyser at a
+time, and the shared single-FFT stage.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+
+from offline import measure, report
+
+
+def stock(server, source):
+    import pyo
+    return [pyo.Yin(source), pyo.Centroid(source),
+            pyo.Follower(source), pyo.PeakAmp(source)]
+
+
+def separate(server, source):
+    # centroid plus one more spectral analyser per new feature
+    from lib.analysers import SpectralAnalyser
+    return stock(server, source) + [SpectralAnalyser(source)
+                                    for _ in ('flux', 'flat', 'ons')]
+
+
+def shared(server, source):
+    import pyo
+    from lib.analysers import SpectralAnalyser
+    return [pyo.Yin(source), pyo.Follower(source), pyo.PeakAmp(source),
+            SpectralAnalyser(source)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HANS analyser benchmark')
+    parser.add_argument('-d', '--duration', type=float, default=20.0,
+                        help='Seconds of audio to render per variant')
+    args = parser.parse_args()
+
+    results = {'stock (4 analysers)': measure(stock, args.duration),
+               'separate spectral analysers': measure(separate,
+                                                      args.duration),
+               'shared spectral stage': measure(shared, args.duration)}
+    report(results, 'stock (4 analysers)', args.duration)
+
+
+if __name__ == '__main__':
+    main()
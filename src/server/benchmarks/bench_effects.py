@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS EFFECTS BENCHMARK
+
+Measures the CPU cost of each Modulator effect on a single sounding
+voice: engaged, bypassed and stopped, and bypassed but still running as
+the chain used to leave it. Combined with the running seconds from the
+voicestats OSC command this tells what bypassing saves.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+from functools import partial
+
+from offline import measure, report
+
+
+def build(engaged, running, server, source):
+    import pyo
+    from lib.modulators import Modulator, Voice
+    table = pyo.HarmTable([1, 0.5, 0.3, 0.2], size=8192)
+    voice = Voice(Modulator.EFFECTS, pyo.Noise(1e-24))
+    setup = {'Volume': False, 'Volume-param': 1, 'Distortion-param': 0.7,
+             'Chorus-param': 2, 'Reverb-param': 0.5}
+    setup.update({name: name in engaged for name in voice.effect_objs})
+    voice.player.setTable(table)
+    voice.player.setFreq(table.getRate())
+    voice.player.setLoop(True)
+    voice.apply(setup)
+    for name in running:
+        voice.effect_objs[name].play()
+    voice.player.play()
+    return voice, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HANS effects benchmark')
+    parser.add_argument('-d', '--duration', type=float, default=20.0,
+                        help='Seconds of audio to render per variant')
+    args = parser.parse_args()
+
+    switches = ('Distortion', 'Chorus', 'Reverb')
+    variants = {'dry, effects stopped': ((), ())}
+    variants.update({f'{name} engaged': ((name,), ())
+                     for name in switches})
+    variants['all engaged'] = (switches, ())
+    variants['dry, effects running'] = ((), switches)
+    results = {label: measure(partial(build, *variant), args.duration)
+               for label, variant in variants.items()}
+    report(results, 'dry, effects stopped', args.duration)
+
+
+if __name__ == '__main__':
+    main()
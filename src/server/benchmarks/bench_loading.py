@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS SAMPLE LOADING BENCHMARK
+
+Times a full SampleBank load of a sample library with a growing number
+of workers, decoding with pyo on threads and, with a cold DecodedCache,
+on worker processes. Threads only pay off if pyo releases the GIL while
+it decodes; the speedup column shows whether they do.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def load(sample_root, workers, processes):
+    import pyo
+    from lib.sample_handling import SampleBank
+    server = pyo.Server(audio='offline', nchnls=1, duplex=0).boot()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        bank = SampleBank(sample_root, workers=workers, processes=processes,
+                          cache_dir=cache_dir if processes else None)
+        elapsed = time.perf_counter() - start
+    samples = sum(len(s) for s in bank.samples.values())
+    server.shutdown()
+    return elapsed, samples
+
+
+def measure(sample_root, workers, processes):
+    # a fresh process per run, no tables or interpreter state carry over
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(load, (sample_root, workers, processes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HANS loading benchmark')
+    parser.add_argument('-s', '--sampleroot', default='./samples/',
+                        help='Path of samples root folder')
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[1, 2, 4, os.cpu_count()],
+                        help='Worker counts to measure')
+    args = parser.parse_args()
+
+    # read every file once, all runs start from the OS page cache
+    for path in Path(args.sampleroot).glob('**/*.aiff'):
+        path.read_bytes()
+    print(f"{'decoder':<10} {'workers':>7} {'samples':>8} {'seconds':>8} "
+          f"{'speedup':>8}")
+    for processes in (False, True):
+        reference = None
+        for workers in sorted(set(args.workers)):
+            elapsed, samples = measure(args.sampleroot, workers, processes)
+            reference = reference or elapsed
+            print(f"{('threads', 'processes')[processes]:<10} {workers:>7} "
+                  f'{samples:>8} {elapsed:>8.3f} '
+                  f'{reference / elapsed:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS OSC ROUTER BENCHMARK
+
+Compares the message throughput of the precompiled OscRouter with the
+substring dispatch hans-server used before, on a mix of MIDI, control,
+command and unknown addresses with no-op handlers.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from lib.osc import OscRouter  # noqa: E402
+
+ANALYSERS = ('yin', 'cen', 'rms', 'amp')
+COMMANDS = ('samplereload', 'rulesreload', 'cacheprune', 'samplestats',
+            'historydump', 'sigprocstats', 'cachestats', 'tempo',
+            'triggerstats', 'chooserstats', 'voicestats', 'solo')
+
+
+def noop(*args):
+    pass
+
+
+class LegacyDispatch(object):
+    # handle_osc and handle_osc_cmd before the routing table
+
+    def handle_osc(self, address, *args):
+        for mtype in ('midi', 'ctrl', 'cmd'):
+            if mtype in address:
+                getattr(self, f'handle_osc_{mtype}')(address, *args)
+
+    def handle_osc_midi(self, address, *args):
+        data = args[0]
+        noop(data[1], data[2], data[3])
+
+    def handle_osc_ctrl(self, address, *args):
+        param = address.split('/')[-1]
+        if param in ANALYSERS:
+            noop(param, args[0])
+
+    def handle_osc_cmd(self, address, *args):
+        # one substring test per command up to the match, as the elif
+        # chain did
+        for name in COMMANDS:
+            if name in address:
+                noop(*args)
+                break
+
+
+def make_router():
+    routes = {'/hans/midi': lambda data: noop(data[1], data[2], data[3])}
+    routes.update({f'/hans/ctrl/{p}': noop for p in ANALYSERS})
+    routes.update({f'/hans/cmd/{c}': noop for c in COMMANDS})
+    return OscRouter(routes)
+
+
+def make_messages(count, rng):
+    # mostly drum triggers, some control and commands, a few strays
+    addresses = (['/hans/midi'] * 12
+                 + [f'/hans/ctrl/{p}' for p in ANALYSERS]
+                 + [f'/hans/cmd/{c}' for c in COMMANDS[:-1]]
+                 + ['/hans/unknown', '/hans/cmd/nothing'])
+    return [(address, (0, 145, 36, 120)) for address in
+            (rng.choice(addresses) for _ in range(count))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HANS OSC router benchmark')
+    parser.add_argument('-m', '--messages', type=int, default=100000)
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help='Timing runs, the best one is reported')
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, random.Random(42))
+    legacy = LegacyDispatch()
+    router = make_router()
+
+    def run(dispatch):
+        for address, data in messages:
+            dispatch(address, data)
+
+    results = {}
+    for name, dispatch in (('legacy substring', legacy.handle_osc),
+                           ('routing table', router.dispatch)):
+        best = min(timeit.repeat(lambda: run(dispatch), number=1,
+                                 repeat=args.number))
+        results[name] = best
+    print(f"{'dispatch':<18} {'msgs/s':>12} {'us/msg':>8} {'speedup':>8}")
+    for name, elapsed in results.items():
+        print(f'{name:<18} {args.messages / elapsed:>12.0f} '
+              f'{1e6 * elapsed / args.messages:>8.3f} '
+              f"{results['legacy substring'] / elapsed:>8.2f}")
+    print(f'rejected by router: {router.rejected // args.number}')
+
+
+if __name__ == '__main__':
+    main()
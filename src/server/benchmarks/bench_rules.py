@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS RULE ENGINE BENCHMARK
+
+Compares the compiled RuleEngine with the per-output loop of the former
+SigProc.calcout, checks that both give the same outputs and times them
+for growing rule sets.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import random
+import sys
+import timeit
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from lib.rules import RuleEngine  # noqa: E402
+
+
+Rule = namedtuple('Rule', ['active', 'inactive', 'weight'])
+
+
+class LegacyEngine(object):
+    # SigProc.calcout and SigProc.age before the rule engine was compiled
+
+    def __init__(self, rules, input_names, output_names):
+        self.rulelist = rules
+        self.inputlist = {name: 0 for name in input_names}
+        self.outputlist = {name: 0 for name in output_names}
+
+    def calcout(self):
+        for output_name in self.outputlist:
+            tmplist = []
+            for rule in self.rulelist:
+                if output_name == rule.inactive:
+                    for rlist in (self.inputlist, self.outputlist):
+                        tmplist += [(rlist[name], rule.weight)
+                                    for name in rlist if name == rule.active]
+            if tmplist:
+                self.outputlist[output_name] = self.calcavg(tmplist)
+                self.age(output_name)
+
+    def age(self, key):
+        try:
+            self.outputlist[f'{key}2'] = 0.5 * self.outputlist[f'{key}1']
+            self.outputlist[f'{key}1'] = self.outputlist[key]
+        except KeyError:
+            pass
+
+    @staticmethod
+    def calcavg(tuplelist):
+        numerator = sum([l[0] * l[1] for l in tuplelist])
+        denominator = sum([l[1] for l in tuplelist])
+        try:
+            return numerator / denominator
+        except ZeroDivisionError:
+            return 0
+
+
+def make_rules(num_rules, num_inputs, num_effects, num_categories, rng):
+    inputs = [f'in{i}' for i in range(num_inputs)]
+    effects = [f'Fx{i}' for i in range(num_effects)]
+    outputs = [f'Cat{i}' for i in range(num_categories)]
+    outputs += [f'{e}{i}' for e in effects for i in ('', '1', '2')]
+    rules = [Rule(f'{e}{i}', e, 1 / i) for e in effects for i in (1, 2)]
+    # most rules read analysers, some chain outputs into each other
+    actives = inputs * 4 + outputs
+    rules += [Rule(rng.choice(actives), rng.choice(outputs),
+                   round(rng.uniform(0.1, 2.0), 2))
+              for _ in range(num_rules)]
+    return rules, inputs, outputs
+
+
+def check(legacy, engine, ticks, rng):
+    error = 0
+    for _ in range(ticks):
+        for i, name in enumerate(engine.input_names):
+            legacy.inputlist[name] = engine.inputs[i] = rng.random()
+        legacy.calcout()
+        engine.evaluate()
+        error = max([error] + [abs(legacy.outputlist[n] - engine.get(n))
+                               for n in engine.output_names])
+    return error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HANS rule engine benchmark')
+    parser.add_argument('-r', '--rules', type=int, nargs='+',
+                        default=[40, 200, 1000, 5000],
+                        help='Rule set sizes to measure')
+    parser.add_argument('-i', '--inputs', type=int, default=16)
+    parser.add_argument('-e', '--effects', type=int, default=5)
+    parser.add_argument('-c', '--categories', type=int, default=6)
+    parser.add_argument('-n', '--number', type=int, default=20,
+                        help='Ticks per timing run')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'rules':>6} {'stages':>6} {'legacy ms':>10} "
+          f"{'engine ms':>10} {'speedup':>8} {'max error':>10}")
+    for num_rules in args.rules:
+        rules, inputs, outputs = make_rules(num_rules, args.inputs,
+                                            args.effects, args.categories,
+                                            rng)
+        legacy = LegacyEngine(rules, inputs, outputs)
+        engine = RuleEngine(rules, inputs, outputs)
+        error = check(legacy, engine, 10, rng)
+        legacy_t = timeit.timeit(legacy.calcout, number=args.number)
+        engine_t = timeit.timeit(engine.evaluate, number=args.number)
+        print(f'{num_rules:>6} {len(engine.stages):>6} '
+              f'{1000 * legacy_t / args.number:>10.3f} '
+              f'{1000 * engine_t / args.number:>10.3f} '
+              f'{legacy_t / engine_t:>8.1f} {error:>10.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS TRIGGER LATENCY BENCHMARK
+
+Measures trigger-to-sound latency on a manually clocked server for a
+trigger fired directly from a callback at the start of a block, as
+RawMidi does, and for one pushed through the TriggerScheduler queue.
+The latency is counted in blocks until a player started by the trigger
+has output, and reported in milliseconds at the given block size.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import multiprocessing
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class Probe(object):
+    # stands in for the Modulator, created before the scheduler like the
+    # voices, so the player sits at the same place in the processing order
+    def __init__(self, pyo):
+        self.table = pyo.DataTable(64, init=[1.0] * 64)
+        self.player = pyo.TableRead(self.table, freq=1, loop=True).stop()
+
+    def execute(self):
+        self.player.play()
+
+    def get_module(self, name):
+        return self
+
+
+def run(queued, triggers, sr, bufsize, seed):
+    import pyo
+    from lib.triggers import TriggerScheduler
+    server = pyo.Server(audio='manual', nchnls=1, duplex=0, sr=sr,
+                        buffersize=bufsize).boot()
+    server.start()
+    probe = Probe(pyo)
+    scheduler = TriggerScheduler(probe, bufsize / sr)
+    scheduler.init()
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(triggers):
+        for _ in range(rng.randrange(1, 8)):
+            server.process()
+        # the callback runs before the next block is processed
+        (scheduler.push if queued else scheduler.fire)()
+        blocks = 0
+        while True:
+            server.process()
+            blocks += 1
+            if probe.player.get() or blocks > 64:
+                break
+        latencies.append(blocks)
+        probe.player.stop()
+        server.process()
+    scheduler.terminate()
+    server.shutdown()
+    return latencies
+
+
+def measure(queued, triggers, sr, bufsize, seed):
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(run, (queued, triggers, sr, bufsize, seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='HANS trigger latency benchmark')
+    parser.add_argument('-n', '--triggers', type=int, default=500,
+                        help='Triggers per path')
+    parser.add_argument('-b', '--bufsize', type=int, default=256,
+                        help='Audio block size in frames')
+    parser.add_argument('-r', '--rate', type=int, default=44100,
+                        help='Sampling rate')
+    args = parser.parse_args()
+
+    block_ms = 1000 * args.bufsize / args.rate
+    print(f"{'path':<8} {'mean ms':>8} {'max ms':>8} {'stdev ms':>9}")
+    for queued in (False, True):
+        blocks = measure(queued, args.triggers, args.rate, args.bufsize, 1)
+        ms = [b * block_ms for b in blocks]
+        print(f"{('direct', 'queued')[queued]:<8} "
+              f'{statistics.mean(ms):>8.2f} {max(ms):>8.2f} '
+              f'{statistics.pstdev(ms):>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
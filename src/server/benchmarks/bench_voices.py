@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HANS VOICE POOL BENCHMARK
+
+Measures the CPU cost of the Modulator voice pool on an offline server
+for growing pool sizes, with every voice sounding, and reports the cost
+per voice with the effects bypassed and engaged.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+from functools import partial
+
+from offline import measure
+
+
+def build(voices, effects, server, source):
+    import pyo
+    from lib.modulators import Modulator, Voice
+    table = pyo.HarmTable([1, 0.5, 0.3, 0.2], size=8192)
+    noise = pyo.Noise(1e-24)
+    pool = [Voice(Modulator.EFFECTS, noise) for _ in range(voices)]
+    setup = {'Volume': False, 'Volume-param': 1, 'Distortion-param': 0.7,
+             'Chorus-param': 2, 'Reverb-param': 0.5}
+    setup.update({e['name']: effects for e in Modulator.EFFECTS
+                  if 'type' in e})
+    for i, voice in enumerate(pool):
+        voice.player.setTable(table)
+        voice.player.setFreq(table.getRate() * (1 + i % 7))
+        voice.player.setLoop(True)
+        voice.apply(setup)
+        voice.player.play()
+    return pool, table, noise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HANS voice pool benchmark')
+    parser.add_argument('-v', '--voices', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16],
+                        help='Pool sizes to measure')
+    parser.add_argument('-d', '--duration', type=float, default=20.0,
+                        help='Seconds of audio to render per pool')
+    args = parser.parse_args()
+
+    base = measure(partial(build, 0, False), args.duration)
+    print(f"{'voices':>6} {'effects':>8} {'cpu %':>7} {'per voice %':>12}")
+    for voices in args.voices:
+        for effects in (False, True):
+            elapsed = measure(partial(build, voices, effects),
+                              args.duration) - base
+            cpu = 100 * elapsed / args.duration
+            print(f"{voices:>6} {('off', 'on')[effects]:>8} {cpu:>7.2f} "
+                  f'{cpu / voices:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Helpers to time pyo graphs on an offline server.
+
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def render(build, duration, sr, bufsize):
+    import pyo
+    server = pyo.Server(audio='offline', nchnls=1, duplex=0, sr=sr,
+                        buffersize=bufsize).boot()
+    with tempfile.TemporaryDirectory() as tmp:
+        server.recordOptions(dur=duration,
+                             filename=os.path.join(tmp, 'bench.wav'))
+        source = pyo.Noise(0.2) + pyo.Sine([220, 331], mul=0.2).mix(1)
+        keep = build(server, source)  # noqa: F841, objects must stay alive
+        start = time.perf_counter()
+        server.start()
+        elapsed = time.perf_counter() - start
+    server.shutdown()
+    return elapsed
+
+
+def measure(build, duration=20.0, sr=44100, bufsize=256):
+    # every graph gets a fresh process and server, returns wall seconds
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(render, (build, duration, sr, bufsize))
+
+
+def report(results, baseline, duration):
+    print(f"{'variant':<28} {'seconds':>8} {'cpu %':>7} {'vs base':>8}")
+    for name, elapsed in results.items():
+        print(f'{name:<28} {elapsed:>8.3f} '
+              f'{100 * elapsed / duration:>7.2f} '
+              f'{elapsed / results[baseline]:>8.2f}')
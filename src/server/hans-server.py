@@ -20,19 +20,21 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import argparse
+import functools
+import itertools
 import json
-import random
 import signal
 import sys
-import threading
 import time
 
 import pyo
 
 import lib.choosers
 import lib.modulators
+import lib.osc
 import lib.seedgens
 import lib.sigprocs
+import lib.triggers
 import lib.util
 from lib.module_base import HansModule
 from lib.sample_handling import SampleBank
@@ -46,21 +48,39 @@ class HansMain(object, metaclass=lib.util.Singleton):
         with open(configfile) as config_file:
             config = json.load(config_file)
             modules = config['modules']
+            channels = config.get('input_channels', [0])
+            block_time = server.getBufferSize() / server.getSamplingRate()
             self.modules = {
-                'samplebank': SampleBank(sample_root=args.sampleroot),
+                'samplebank': SampleBank(sample_root=args.sampleroot,
+                                         progress=print_progress,
+                                         sample_rate=server.getSamplingRate(),
+                                         **config.get('samplebank', {})),
                 'seedgen':
-                getattr(lib.seedgens, modules['seedgen'])(self),
+                getattr(lib.seedgens, modules['seedgen'])(
+                    self, **self.get_options(config, modules, 'seedgen')),
                 'sigproc':
                 getattr(lib.sigprocs, modules['sigproc'])(
-                    self, pyo.Input(), args.rulesfile),
+                    self, pyo.Input(chnl=channels), args.rulesfile,
+                    channels=channels, **config.get('sigproc', {})),
                 'chooser':
-                getattr(lib.choosers, modules['chooser'])(self),
+                getattr(lib.choosers, modules['chooser'])(
+                    self, **self.get_options(config, modules, 'chooser')),
                 'modulator':
-                getattr(lib.modulators, modules['modulator'])(self),
-                'oscproc': OSCProc(args.oscport),
-                'midiproc': MidiProc()
+                getattr(lib.modulators, modules['modulator'])(
+                    self, block_time=block_time,
+                    **config.get('modulator', {})),
+                'scheduler': lib.triggers.TriggerScheduler(
+                    self, block_time, **config.get('scheduler', {})),
+                'oscproc': OSCProc(args.oscport, block_time,
+                                   **config.get('osc', {})),
+                'midiproc': MidiProc(**config.get('midi', {}))
             }
 
+    @staticmethod
+    def get_options(config, modules, name):
+        # options are kept per implementation, for the selected one only
+        return config.get(name, {}).get(modules[name], {})
+
     def start(self):
         for name, module in self.modules.items():
             if isinstance(module, HansModule):
@@ -78,83 +98,159 @@ class HansMain(object, metaclass=lib.util.Singleton):
     def get_effect_types(self):
         return self.get_module('modulator').get_effect_types()
 
+    def get_effect_ranges(self):
+        return self.get_module('modulator').get_effect_ranges()
+
 
 class MidiProc:
-    def __init__(self):
+    def __init__(self, notes=None, budget=None):
         self.rawm = pyo.RawMidi(handle_midievent)
-        self.trigger_notes = {}
-        # accented bass drum
-        for i in (35, 36):
-            self.add_trigger(i, 64, 0.5)
-        # accented snare
-        for i in (38, 40):
-            self.add_trigger(i, 70, 0.25)
-        # accented toms
-        for i in (41, 45, 48, 50):
-            self.add_trigger(i, 70, 0.15)
-        # accented cymbals
-        for i in (49, 51, 55, 57, 59):
-            self.add_trigger(i, 70, 0.1)
-
-    def add_trigger(self, note, velocity, limit):
-        self.trigger_notes[note] = {'velocity': velocity,
-                                    'limit': limit}
-
-
-def handle_midievent(status, note, velocity):
-    # filter note-on messages
-    if 144 <= status <= 159:
-        try:
-            midiproc = hans.get_module('midiproc')
-            if velocity > midiproc.trigger_notes[note]['velocity'] and \
-               random.random() < midiproc.trigger_notes[note]['limit']:
-                hans.get_module('modulator').execute()
-        except KeyError:
-            pass
-
-
-class OSCProc:
-    def __init__(self, port=5005):
-        self.receiver = pyo.OscDataReceive(port, '/hans/*', handle_osc)
-
+        self.triggers = lib.triggers.TriggerTable(notes, budget)
 
-def handle_osc(address, *args):
-    for mtype in ('midi', 'ctrl', 'cmd'):
-        if mtype in address:
-            globals()[f'handle_osc_{mtype}'](address, *args)
 
-
-def handle_osc_midi(address, *args):
+def handle_midievent(status, note, velocity, queued=False):
+    # filter note-on messages; RawMidi and the scheduler call this on the
+    # audio thread, other threads pass queued
+    if 144 <= status <= 159:
+        triggers = hans.get_module('midiproc').triggers
+        if triggers.accept(note, velocity, time.perf_counter(),
+                           hans.get_module('seedgen').random):
+            scheduler = hans.get_module('scheduler')
+            if queued:
+                scheduler.push()
+            else:
+                scheduler.fire()
+
+
+class OSCProc(HansModule):
+    def __init__(self, port=5005, block_time=None, backend='pyo',
+                 **options):
+        self.router = lib.osc.OscRouter()
+        # 'pyo' handles messages on pyo's OSC thread, 'asyncio' on a
+        # python-osc loop with the engine fed once per block
+        self.server = None
+        self.receiver = None
+        if backend == 'asyncio':
+            self.server = lib.osc.AsyncOscServer(self.router, port,
+                                                 block_time, **options)
+        else:
+            self.receiver = pyo.OscDataReceive(port, '/hans/*',
+                                               self.router.dispatch)
+
+    def init(self):
+        # routes are fixed once the analysers are known
+        sigproc = hans.get_module('sigproc')
+        self.router.add('/hans/midi', handle_osc_midi)
+        for param in sigproc.analysers:
+            self.router.add(f'/hans/ctrl/{param}',
+                            functools.partial(sigproc.set_inputlim, param))
+        for name, handler in OSC_COMMANDS.items():
+            self.router.add(f'/hans/cmd/{name}', handler)
+        if self.server is not None:
+            self.server.start()
+
+    def terminate(self):
+        if self.server is not None:
+            self.server.stop()
+
+    def get_stats(self):
+        stats = self.router.get_stats()
+        if self.server is not None:
+            stats.update(self.server.get_stats())
+        return stats
+
+
+def handle_osc_midi(*args):
     data = args[0]
     midi = (data[1], data[2], data[3])
-    handle_midievent(*midi)
-
+    handle_midievent(*midi, queued=True)
+
+
+def print_json(data):
+    print(json.dumps(data))
+
+
+def reply_json(address, messages, host, port):
+    # pyo does not tell who sent a message, the sender names itself
+    sender = pyo.OscDataSend('s', int(port), address, host=str(host))
+    for data in messages:
+        sender.send([json.dumps(data)])
+
+
+def handle_samplestats(*args):
+    # [path] dumps on the server, <host> <port> replies over OSC with
+    # the totals and then one message per category, the per-sample list
+    # of a large library would not fit a datagram
+    samplebank = hans.get_module('samplebank')
+    if len(args) < 2:
+        samplebank.dump_stats(*args[:1])
+        return
+    stats = samplebank.get_stats()
+    categories = stats['categories']
+    messages = [{'load_time': stats['load_time'], 'cache': stats['cache'],
+                 'categories': len(categories)}]
+    messages += [dict(summary, category=category)
+                 for category, summary in categories.items()]
+    reply_json('/hans/samplestats', messages, *args[:2])
+
+
+OSC_COMMANDS = {
+    'samplereload':
+    lambda *args: hans.get_module('chooser').reload_samples(),
+    'rulesreload':
+    lambda *args: hans.get_module('sigproc').set_rules_toggle_levels(),
+    'cacheprune':
+    lambda *args: hans.get_module('samplebank').prune_cache(*args[:1]),
+    'samplestats': handle_samplestats,
+    'historydump':
+    lambda *args: hans.get_module('sigproc').export_history(
+        *(args[:1] or ['hans-history.npz'])),
+    'sigprocstats':
+    lambda *args: print_json(hans.get_module('sigproc').get_timing_stats()),
+    'cachestats':
+    lambda *args: print_json(hans.get_module('samplebank').get_cache_stats()),
+    'tempo':
+    lambda *args: hans.get_module('scheduler').set_tempo(*args[:2]),
+    'triggerstats':
+    lambda *args: print_json(dict(
+        hans.get_module('scheduler').get_stats(),
+        table=hans.get_module('midiproc').triggers.get_stats())),
+    'chooserstats':
+    lambda *args: print_json(
+        getattr(hans.get_module('chooser'), 'get_stats', dict)()),
+    'voicestats':
+    lambda *args: print_json(hans.get_module('modulator').get_stats()),
+    'oscstats':
+    lambda *args: print_json(hans.get_module('oscproc').get_stats()),
+    'solo':
+    lambda *args: do_the_wookiee_boogie(),
+    'solostop':
+    lambda *args: hans.get_module('scheduler').cancel_solo(),
+}
 
-def handle_osc_ctrl(address, *args):
-    param = address.split('/')[-1]
-    sigproc = hans.get_module('sigproc')
-    if param in sigproc.analysers:
-        sigproc.set_inputlim(param, args[0])
 
-
-def handle_osc_cmd(address, *args):
-    if 'samplereload' in address:
-        hans.get_module('chooser').reload_samples()
-    elif 'rulesreload' in address:
-        hans.get_module('sigproc').set_rules_toggle_levels()
-    elif 'solo' in address:
-        threading.Thread(target=do_the_wookiee_boogie).start()
+def do_the_wookiee_boogie():
+    # the whole solo is scheduled ahead on the trigger scheduler
+    seedgen = hans.get_module('seedgen')
+    gaps = [0.07 + seedgen.random()/4
+            for _ in range(seedgen.randrange(42, 65) - 1)]
+    delays = list(itertools.accumulate(gaps, initial=0))
+    hans.get_module('scheduler').start_solo(
+        delays, functools.partial(handle_midievent, 145, 36, 125))
 
 
-def do_the_wookiee_boogie():
-    for _ in range(random.randrange(42, 65)):
-        handle_midievent(145, 36, 125)
-        time.sleep(0.07 + random.random()/4)
+def print_progress(done, total):
+    print(f'\rLoading samples: {done}/{total}', end='', flush=True)
+    if done == total:
+        print()
 
 
 def hansstopit(signum, frame):
     server.deactivateMidi()
     hans.get_module('sigproc').terminate()
+    hans.get_module('scheduler').terminate()
+    hans.get_module('seedgen').terminate()
+    hans.get_module('oscproc').terminate()
     server.stop()
     time.sleep(0.2)
     print()
@@ -185,10 +281,10 @@ if __name__ == "__main__":
                         action='store_true')
     args = parser.parse_args()
 
-    if int(''.join(map(str, pyo.getVersion()))) < 76:
-        # RawMidi is supported only since Python-Pyo version 0.7.6
+    if tuple(pyo.getVersion()) < (1, 0, 0):
+        # delayed stop, TableFill and table buffers need Python-Pyo 1.0.0
         raise SystemError("Please, update your Python-Pyo install "
-                          "to version 0.7.6 or later.")
+                          "to version 1.0.0 or later.")
 
     if args.midi:
         midi_id = args.midi
@@ -198,7 +294,9 @@ if __name__ == "__main__":
         while (midi_id > pyo.pm_count_devices()-1 and midi_id != 99) or midi_id < 0:
             midi_id = eval(input("Please select input ID [99 for all]: "))
 
-    server_args = {'duplex': 1, 'ichnls': 1}
+    with open(args.configfile) as config_file:
+        channels = json.load(config_file).get('input_channels', [0])
+    server_args = {'duplex': 1, 'ichnls': max(channels) + 1}
     if not sys.platform.startswith('win'):
         server_args.update({'audio': 'jack', 'jackname': 'HANS'})
     server = pyo.Server(**server_args)
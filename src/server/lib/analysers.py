@@ -0,0 +1,193 @@
+"""
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from collections import deque
+
+import numpy
+import pyo
+
+
+def build_analyser(module, audioin, lowpass=None, downsample=1,
+                   **settings):
+    # optional low-pass and power-of-two decimation ahead of an analyser,
+    # the rest of the settings go to its constructor
+    server = audioin.getServer()
+    if module is SpectralAnalyser and downsample != 1:
+        settings['rate'] = audioin.getSamplingRate() / downsample
+    if lowpass:
+        audioin = pyo.ButLP(audioin, freq=lowpass)
+    if downsample == 1:
+        return module(audioin, **settings)
+    server.beginResamplingBlock(-downsample)
+    analyser = module(pyo.Resample(audioin, mode=8), **settings)
+    server.endResamplingBlock()
+    return analyser
+
+
+class SpectralFeature(object):
+    # Stands in for a pyo analyser: SigProc only calls get()
+
+    def __init__(self, stage, name):
+        self.stage = stage
+        self.name = name
+
+    def get(self, all=False):
+        values = self.stage.values[self.name]
+        if all:
+            return values.tolist()
+        return float(values[0])
+
+
+class SpectralAnalyser(object):
+    # One FFT per hop and input channel on the audio thread, every
+    # spectral feature is derived from the same magnitude spectrum.
+    FEATURES = ('cen', 'flux', 'flat', 'ons')
+
+    def __init__(self, audioin, size=1024, hop=512, onset_window=2.0,
+                 onset_ratio=1.5, rate=None):
+        self.size = size
+        self.onset_ratio = onset_ratio
+        rate = rate or audioin.getSamplingRate()
+        chnls = len(audioin)
+        self.table = pyo.DataTable(size, chnls=chnls)
+        self.fill = pyo.TableFill(audioin, self.table)
+        self.rings = [numpy.asarray(self.table.getBuffer(c))
+                      for c in range(chnls)]
+        self.window = numpy.hanning(size)
+        self.frame = numpy.zeros((chnls, size))
+        self.freqs = numpy.fft.rfftfreq(size, 1 / rate)
+        self.mags = numpy.zeros((chnls, len(self.freqs)))
+        self.prev_mags = numpy.zeros((chnls, len(self.freqs)))
+        self.diff = numpy.zeros((chnls, len(self.freqs)))
+        self.total = numpy.zeros(chnls)
+        self.flux_mean = numpy.zeros(chnls)
+        self.onset_armed = numpy.ones(chnls, dtype=bool)
+        self.onsets = [deque() for _ in range(chnls)]
+        self.frames = 0
+        self.onset_frames = max(1, int(onset_window * rate / hop))
+        self.onset_window = onset_window
+        self.values = {f: numpy.zeros(chnls) for f in self.FEATURES}
+        self.pattern = pyo.Pattern(self.process, time=hop / rate).play()
+
+    def feature(self, name):
+        return SpectralFeature(self, name)
+
+    def process(self):
+        # unroll the ring buffers so the newest sample is last
+        pos = self.fill.getCurrentPos()
+        tail = self.size - pos
+        for frame, ring in zip(self.frame, self.rings):
+            frame[:tail] = ring[pos:]
+            frame[tail:] = ring[:pos]
+        numpy.multiply(self.frame, self.window, out=self.frame)
+        numpy.abs(numpy.fft.rfft(self.frame, axis=1), out=self.mags)
+        numpy.sum(self.mags, axis=1, out=self.total)
+        silent = self.total <= 1e-9
+        numpy.maximum(self.total, 1e-9, out=self.total)
+        values = self.values
+        numpy.dot(self.mags, self.freqs, out=values['cen'])
+        numpy.divide(values['cen'], self.total, out=values['cen'])
+        numpy.subtract(self.mags, self.prev_mags, out=self.diff)
+        numpy.maximum(self.diff, 0, out=self.diff)
+        numpy.sum(self.diff, axis=1, out=values['flux'])
+        numpy.divide(values['flux'], self.total, out=values['flux'])
+        # flatness: geometric over arithmetic mean of the magnitudes
+        numpy.add(self.mags, 1e-12, out=self.diff)
+        numpy.log(self.diff, out=self.diff)
+        numpy.mean(self.diff, axis=1, out=values['flat'])
+        numpy.exp(values['flat'], out=values['flat'])
+        numpy.divide(values['flat'], self.total / self.mags.shape[1],
+                     out=values['flat'])
+        for name in ('cen', 'flux', 'flat'):
+            values[name][silent] = 0
+        self.mags, self.prev_mags = self.prev_mags, self.mags
+        self.detect_onsets(values['flux'])
+
+    def detect_onsets(self, flux):
+        self.frames += 1
+        rising = (flux > self.onset_ratio * self.flux_mean) & (flux > 0.05)
+        for chnl in numpy.flatnonzero(rising & self.onset_armed):
+            self.onsets[chnl].append(self.frames)
+        self.onset_armed = ~rising
+        self.flux_mean += 0.1 * (flux - self.flux_mean)
+        for chnl, onsets in enumerate(self.onsets):
+            while onsets and onsets[0] <= self.frames - self.onset_frames:
+                onsets.popleft()
+            self.values['ons'][chnl] = len(onsets) / self.onset_window
+
+
+class AnalyserHistory(object):
+    # Analyser values captured once per period on the audio thread. The
+    # ring is stored twice side by side, so the latest frames are always
+    # one contiguous slice and reading a window never copies.
+    STATS = ('mean', 'max', 'trend')
+
+    def __init__(self, analysers, names, seconds=8.0, period=0.01,
+                 window=1.0):
+        # one row per analyser and input channel, in the order of names
+        self.names = list(names)
+        self.modules = [a.module for a in analysers.values()]
+        self.streams = len(self.names) // len(self.modules)
+        self.limits = numpy.repeat([a.limit for a in analysers.values()],
+                                   self.streams).astype(float)
+        self.period = period
+        self.length = max(2, int(round(seconds / period)))
+        self.frames = min(self.length, max(2, int(round(window / period))))
+        self.data = numpy.zeros((len(self.names), 2 * self.length))
+        self.pos = 0
+        # least-squares slope over the window, scaled to the window length
+        t = numpy.arange(self.frames) - (self.frames - 1) / 2
+        self.trend_kernel = t * self.frames / (t ** 2).sum()
+        self.stats = numpy.zeros((len(self.STATS), len(self.names)))
+        self.pattern = pyo.Pattern(self.capture, time=period).play()
+
+    def get_input_names(self):
+        return self.names + [f'{n}_{stat}' for stat in self.STATS
+                             for n in self.names]
+
+    def capture(self):
+        pos, length, streams = self.pos, self.length, self.streams
+        for i, module in enumerate(self.modules):
+            rows = slice(i * streams, (i + 1) * streams)
+            self.data[rows, pos] = self.data[rows, pos + length] = \
+                module.get(all=True)
+        self.pos = (pos + 1) % length
+
+    def window(self, frames=None):
+        frames = frames or self.length
+        end = self.pos + self.length
+        return self.data[:, end - frames:end]
+
+    def read(self, inputs):
+        # inputs: latest, mean, max and trend blocks, normalised to 0..1
+        view = self.window(self.frames)
+        n = len(self.names)
+        mean, peak, trend = self.stats
+        numpy.mean(view, axis=1, out=mean)
+        numpy.max(view, axis=1, out=peak)
+        numpy.dot(view, self.trend_kernel, out=trend)
+        numpy.divide(view[:, -1], self.limits, out=inputs[:n])
+        numpy.divide(self.stats, self.limits, out=self.stats)
+        inputs[n:4 * n] = self.stats.ravel()
+        # a flat trend sits at 0.5
+        numpy.multiply(inputs[3 * n:4 * n], 0.5, out=inputs[3 * n:4 * n])
+        numpy.add(inputs[3 * n:4 * n], 0.5, out=inputs[3 * n:4 * n])
+        numpy.clip(inputs[:4 * n], 0, 1, out=inputs[:4 * n])
+
+    def export(self, path):
+        numpy.savez(path, names=numpy.array(self.names),
+                    period=self.period, data=self.window())
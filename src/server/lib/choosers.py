@@ -15,11 +15,45 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from .module_base import HansModule
 from .sample_handling import SampleBank
 
 
+class AliasTable(object):
+    # Vose's alias method: O(n) to build, a draw is one uniform variate
+    # and one comparison, whatever the number of outcomes.
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        self.size = n
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        if not n or total <= 0:
+            return
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def draw(self, u):
+        # u is uniform in [0, 1)
+        u *= self.size
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+
 class ChooserBase(HansModule):
     def __init__(self, main):
         raise NotImplementedError
@@ -31,21 +65,33 @@ class ChooserBase(HansModule):
         self.execute()
         return getattr(self, 'output', None)
 
+    def update(self, snapshot):
+        # SigProc publishes every new snapshot here
+        if self.sample_bank is not None:
+            self.sample_bank.prefetch(snapshot.categories)
+
     def reload_samples(self):
-        self.sample_bank.reload_samples()
+        self.sample_bank.reload_samples_async()
 
     def set_sample_root(self, sample_root):
         self.sample_bank = SampleBank(sample_root)
 
     def choose_from_categories(self, categories):
         try:
-            category = random.choice(categories)
-            idx = (getattr(self, 'seedgen', None).get_output()
-                   % len(self.sample_bank.samples[category]))
-            self.output = self.sample_bank.samples[category][idx]
+            category = self.seedgen.choice(categories)
+            self.choose_sample(category)
         except:
             self.output = None
 
+    def choose_sample(self, category):
+        samples = self.sample_bank.samples[category]
+        idx = self.seedgen.get_output() % len(samples)
+        self.set_output(samples[idx])
+
+    def set_output(self, sample):
+        self.output = sample
+        self.output.last_chosen = time.time()
+
 
 class BasicChooser(ChooserBase):
     def __init__(self, main):
@@ -59,18 +105,33 @@ class BasicChooser(ChooserBase):
         self.seedgen = self.main.get_module('seedgen')
 
     def execute(self):
-        categories = self.sample_bank.samples.keys()
+        categories = list(self.sample_bank.samples)
         self.choose_from_categories(categories)
 
 
 class IntelligentChooser(ChooserBase):
-    def __init__(self, main):
+    Table = namedtuple('Table', ['alias', 'outcomes', 'samples'])
+
+    def __init__(self, main, weighted=False, weighted_samples=False):
         self.main = main
         self.output = None
         self.seedgen = None
         self.sample_bank = None
         self.sigproc = None
-
+        # SigProc snapshot version of the last choice
+        self.version = 0
+        # draw active categories in proportion to their scores, or with
+        # weighted_samples their samples directly, each category still
+        # in proportion to its score
+        self.weighted = weighted or weighted_samples
+        self.weighted_samples = weighted_samples
+        self.table = None
+        # tables are built on a worker from the latest pending snapshot
+        self.table_key = None
+        self.latest = None
+        self.building = False
+        self.lock = threading.Lock()
+        self.builder = ThreadPoolExecutor(max_workers=1)
 
     def init(self):
         self.sample_bank = self.main.get_module('samplebank')
@@ -78,7 +139,140 @@ class IntelligentChooser(ChooserBase):
         self.seedgen = self.main.get_module('seedgen')
 
     def execute(self):
-        categories = [c for c, v in
-                      self.sigproc.get_output()['samples'].items()
-                      if v is True]
-        self.choose_from_categories(categories)
+        snapshot = self.sigproc.get_output()
+        self.version = snapshot.version
+        table = self.table
+        if (not self.weighted or table is None
+                or table.samples is not self.sample_bank.samples):
+            # no table yet for this library, fall back to an even draw
+            self.choose_from_categories(snapshot.categories)
+            return
+        try:
+            outcome = table.outcomes[table.alias.draw(self.seedgen.random())]
+            if self.weighted_samples:
+                self.set_output(outcome)
+            else:
+                self.choose_sample(outcome)
+        except:
+            self.output = None
+
+    def update(self, snapshot):
+        # called on the SigProc tick, possibly in the audio callback: only
+        # a change of the active categories, their scores or the library
+        # hands the snapshot to the builder
+        super().update(snapshot)
+        if not self.weighted or self.sample_bank is None:
+            return
+        samples = self.sample_bank.samples
+        key = (id(samples), tuple((c, snapshot.scores[c])
+                                  for c in snapshot.categories))
+        if key == self.table_key:
+            return
+        self.table_key = key
+        with self.lock:
+            self.latest = (snapshot, samples)
+            if self.building:
+                return
+            self.building = True
+        self.builder.submit(self.build_tables)
+
+    def build_tables(self):
+        while True:
+            with self.lock:
+                latest, self.latest = self.latest, None
+                if latest is None:
+                    self.building = False
+                    return
+            # swapped in whole, a trigger only draws from the current one
+            self.table = self.build_table(*latest)
+
+    def build_table(self, snapshot, samples):
+        weights = []
+        outcomes = []
+        for category in snapshot.categories:
+            score = max(snapshot.scores[category], 0)
+            members = samples.get(category)
+            if not members:
+                continue
+            if self.weighted_samples:
+                # a category weighs its score whatever its size
+                outcomes += members
+                weights += [score / len(members)] * len(members)
+            else:
+                outcomes.append(category)
+                weights.append(score)
+        return self.Table(AliasTable(weights), outcomes, samples)
+
+
+class SampleDeck(object):
+    # Swap pool over the samples of one category: the first `available`
+    # slots can be drawn, the rest were used within the no-repeat window.
+    # Drawing and releasing are a swap each, O(1) at any library size.
+
+    def __init__(self, samples, window):
+        self.pool = list(samples)
+        self.slots = {id(s): i for i, s in enumerate(self.pool)}
+        self.window = max(0, min(window, len(self.pool) - 1))
+        self.available = len(self.pool)
+        self.recent = deque()
+        self.counts = {id(s): 0 for s in self.pool}
+
+    def swap(self, i, j):
+        pool = self.pool
+        pool[i], pool[j] = pool[j], pool[i]
+        self.slots[id(pool[i])] = i
+        self.slots[id(pool[j])] = j
+
+    def draw(self, seed):
+        sample = self.pool[seed % self.available]
+        self.available -= 1
+        self.swap(self.slots[id(sample)], self.available)
+        self.recent.append(sample)
+        if len(self.recent) > self.window:
+            released = self.recent.popleft()
+            self.swap(self.slots[id(released)], self.available)
+            self.available += 1
+        self.counts[id(sample)] += 1
+        return sample
+
+    def get_stats(self):
+        counts = list(self.counts.values())
+        draws = sum(counts)
+        mean = draws / max(len(counts), 1)
+        variance = sum((c - mean) ** 2 for c in counts) / max(len(counts), 1)
+        return {'samples': len(counts),
+                'window': self.window,
+                'draws': draws,
+                'used': sum(c > 0 for c in counts),
+                'min': min(counts, default=0),
+                'max': max(counts, default=0),
+                # coefficient of variation, 0 when perfectly even
+                'spread': variance ** 0.5 / mean if mean else 0}
+
+
+class NoRepeatChooser(IntelligentChooser):
+    # A sample is not chosen again until `window` other samples of its
+    # category were played. window is an int or a dict per category.
+
+    def __init__(self, main, window=4, weighted=False):
+        super().__init__(main, weighted=weighted)
+        self.window = window
+        self.decks = {}
+        self.decks_source = None
+
+    def choose_sample(self, category):
+        samples = self.sample_bank.samples
+        if samples is not self.decks_source:
+            # the bank swapped in a new library, start over
+            self.decks = {}
+            self.decks_source = samples
+        if category not in self.decks:
+            window = self.window
+            if isinstance(window, dict):
+                window = window.get(category, 0)
+            self.decks[category] = SampleDeck(samples[category], window)
+        self.set_output(self.decks[category].draw(self.seedgen.get_output()))
+
+    def get_stats(self):
+        return {category: deck.get_stats()
+                for category, deck in self.decks.items()}
@@ -0,0 +1,183 @@
+"""
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy
+
+
+FEATURES = ('duration', 'channels', 'rate', 'rms', 'centroid', 'pitch')
+# AIFF-C compression types that are plain PCM or float
+COMPRESSIONS = (b'NONE', b'twos', b'sowt', b'fl32', b'FL32', b'fl64',
+                b'FL64')
+
+
+def read_aiff(path):
+    # Minimal AIFF/AIFF-C reader, so that analysis needs no pyo server
+    with open(path, 'rb') as aiff:
+        form, _, kind = struct.unpack('>4sI4s', aiff.read(12))
+        if form != b'FORM' or kind not in (b'AIFF', b'AIFC'):
+            raise ValueError(f'{path} is not an AIFF file')
+        comp, data = b'NONE', None
+        while data is None:
+            header = aiff.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{path} has no sound data')
+            ckid, size = struct.unpack('>4sI', header)
+            chunk = aiff.read(size + size % 2)
+            if ckid == b'COMM':
+                chnls, frames, bits = struct.unpack('>hIh', chunk[:8])
+                exp, mant = struct.unpack('>HQ', chunk[8:18])
+                rate = mant * 2.0 ** ((exp & 0x7fff) - 16383 - 63)
+                if kind == b'AIFC':
+                    comp = chunk[18:22]
+            elif ckid == b'SSND':
+                offset = struct.unpack('>I', chunk[:4])[0]
+                data = chunk[8 + offset:]
+    if comp not in COMPRESSIONS:
+        raise ValueError(f'{path} uses unsupported compression {comp!r}')
+    width = (bits + 7) // 8
+    if comp in (b'fl32', b'FL32'):
+        samples = numpy.frombuffer(data, '>f4', chnls * frames)
+    elif comp in (b'fl64', b'FL64'):
+        samples = numpy.frombuffer(data, '>f8', chnls * frames)
+    elif width == 3:
+        raw = numpy.frombuffer(data, numpy.uint8, chnls * frames * 3)
+        raw = raw.reshape(-1, 3).astype(numpy.int32)
+        samples = (raw[:, 0] << 24 | raw[:, 1] << 16 | raw[:, 2] << 8) / 2**31
+    else:
+        endian = '<' if comp == b'sowt' else '>'
+        samples = numpy.frombuffer(data, f'{endian}i{width}', chnls * frames)
+        samples = samples / 2.0 ** (8 * width - 1)
+    return samples.reshape(-1, chnls).T.astype(numpy.float32), rate
+
+
+def analyse(path, frame_size=2048, max_frames=64, minfreq=40, maxfreq=1000):
+    audio, rate = read_aiff(path)
+    mono = audio.mean(axis=0)
+    features = {'duration': mono.size / rate,
+                'channels': audio.shape[0],
+                'rate': rate,
+                'rms': float(numpy.sqrt(numpy.mean(mono ** 2))),
+                'centroid': 0.0,
+                'pitch': 0.0}
+    if mono.size < frame_size:
+        mono = numpy.pad(mono, (0, frame_size - mono.size))
+    # analyse evenly spaced frames only, long soundscapes stay cheap
+    starts = numpy.linspace(0, mono.size - frame_size,
+                            min(max_frames, mono.size // frame_size or 1))
+    frames = numpy.stack([mono[int(s):int(s) + frame_size] for s in starts])
+    frames *= numpy.hanning(frame_size)
+    mags = numpy.abs(numpy.fft.rfft(frames, axis=1))
+    freqs = numpy.fft.rfftfreq(frame_size, 1 / rate)
+    if mags.sum() > 0:
+        features['centroid'] = float((mags.sum(axis=0) * freqs).sum()
+                                     / mags.sum())
+    features['pitch'] = estimate_pitch(frames, rate, minfreq, maxfreq)
+    return features
+
+
+def estimate_pitch(frames, rate, minfreq, maxfreq, threshold=0.3):
+    # normalised autocorrelation of the loudest frames, median of the lags
+    energy = (frames ** 2).sum(axis=1)
+    loud = frames[energy >= 0.5 * energy.max()] if energy.max() > 0 else []
+    if not len(loud):
+        return 0.0
+    spectrum = numpy.fft.rfft(loud, n=2 * frames.shape[1], axis=1)
+    acf = numpy.fft.irfft(numpy.abs(spectrum) ** 2, axis=1)
+    acf = acf[:, :frames.shape[1]] / numpy.maximum(acf[:, :1], 1e-12)
+    lo = int(rate / maxfreq)
+    hi = min(int(rate / minfreq), frames.shape[1] - 1)
+    if hi <= lo:
+        return 0.0
+    lags = acf[:, lo:hi].argmax(axis=1) + lo
+    voiced = acf[numpy.arange(len(lags)), lags] >= threshold
+    if not voiced.any():
+        return 0.0
+    return float(rate / numpy.median(lags[voiced]))
+
+
+class SampleManifest(object):
+    # Index file layout:
+    # {"features": [...], "samples": {relpath: [mtime_ns, size, *values]}}
+
+    def __init__(self, sample_root, workers=None,
+                 filename='hans-manifest.json'):
+        self.sample_root = Path(sample_root)
+        self.workers = workers
+        self.path = self.sample_root / filename
+        self.samples = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return
+        if tuple(manifest.get('features', ())) == FEATURES:
+            self.samples = manifest['samples']
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as manifest_file:
+            json.dump({'features': FEATURES, 'samples': self.samples},
+                      manifest_file, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def update(self, paths):
+        samples, stale = {}, {}
+        for path in paths:
+            key = Path(path).relative_to(self.sample_root).as_posix()
+            stat = Path(path).stat()
+            signature = [stat.st_mtime_ns, stat.st_size]
+            known = self.samples.get(key)
+            if known is not None and known[:2] == signature:
+                samples[key] = known
+            else:
+                stale[key] = (path, signature)
+        if stale:
+            # spawn, forking a process with audio threads is unsafe
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=ctx) as pool:
+                futures = {key: pool.submit(analyse, path)
+                           for key, (path, _) in stale.items()}
+                for key, future in futures.items():
+                    try:
+                        features = future.result()
+                    except Exception as e:
+                        print(f'Sample analysis failed for {key}: {e}')
+                        continue
+                    samples[key] = stale[key][1] + [features[f]
+                                                    for f in FEATURES]
+        changed = bool(stale) or len(samples) != len(self.samples)
+        self.samples = samples
+        if changed:
+            self.save()
+
+    def get(self, path):
+        key = Path(path).relative_to(self.sample_root).as_posix()
+        values = self.samples.get(key)
+        if values is None:
+            return None
+        return dict(zip(FEATURES, values[2:]))
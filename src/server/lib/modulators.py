@@ -15,81 +15,277 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import random
+import time
+from operator import attrgetter
 import pyo
 from .module_base import HansModule
 
 
+class Voice(object):
+    # One player with its own effect chain. Voices are built once, a
+    # trigger only retargets the player and sets the parameters.
+
+    def __init__(self, chain, denorm_noise, ramp_time=0.05, block_time=0):
+        # effect parameters are smoothed control signals, updates ramp in
+        # on the audio thread; a new sample starts on its own values
+        self.ramp_time = ramp_time
+        self.ramp = ramp_time
+        self.block_time = block_time
+        self.controls = {}
+        for effect in chain:
+            name = effect['name']
+            if name == 'Volume':
+                self.controls[name] = pyo.SigTo(1, time=ramp_time)
+            elif 'type' in effect:
+                self.controls[f'{name}-param'] = pyo.SigTo(0, time=ramp_time)
+                self.controls[name] = pyo.SigTo(0, time=ramp_time)
+        self.values = dict.fromkeys(self.controls)
+        self.player = pyo.TableRead(pyo.NewTable(0.1), loop=False)
+        # long samples are streamed from disk, one player per channel
+        # count, built by the Modulator before any trigger
+        self.streamers = {}
+        self.source = pyo.InputFader(self.player,
+                                     mul=self.controls.get('Volume', 1))
+        self.level = pyo.Follower(self.source, freq=10)
+        # only the declared effects are built, each behind a dry/wet
+        # switch; bypassed effects are stopped and cost nothing
+        self.effect_objs = {}
+        self.switches = {}
+        signal = self.source
+        for effect in chain:
+            if 'type' not in effect:
+                continue
+            name = effect['name']
+            args = dict(effect.get('args', {}))
+            args[effect['param']] = self.controls[f'{name}-param']
+            obj = getattr(pyo, effect['type'])(signal + denorm_noise, **args)
+            self.effect_objs[name] = obj
+            obj.stop()
+            signal = self.switches[name] = pyo.Interp(
+                signal, obj, interp=self.controls[name])
+        self.output = pyo.Pan(signal, outs=2, spread=0.1)
+        self.output.out()
+        self.running_since = dict.fromkeys(self.effect_objs)
+        self.running_time = dict.fromkeys(self.effect_objs, 0)
+        self.category = None
+        self.effects = None
+        self.started = 0
+        self.ends_at = 0
+
+    def play(self, sample, table, effects, pan, now):
+        self.stop()
+        self.set_ramp(0)
+        speed = {True: effects.get('Speed-param'),
+                 False: 1}[effects.get('Speed', False)]
+        if sample.streamed:
+            player, mixdown = self.streamers[sample.channels]
+            player.setPath(str(sample.path))
+            player.setSpeed(speed)
+            self.source.setInput(mixdown, fadetime=0.001)
+        else:
+            player = self.player
+            player.setTable(table)
+            player.setFreq(sample.audio_rate * speed)
+            self.source.setInput(player, fadetime=0.001)
+        self.apply(effects)
+        self.output.setPan(pan)
+        self.category = sample.category
+        self.started = now
+        self.ends_at = now + (sample.duration / speed if speed
+                              else float('inf'))
+        player.play()
+
+    def update(self, effects, now):
+        # the ramp comes back once the values set on play were rendered
+        # for a block, otherwise the attack would still ramp
+        if not self.ramp and now - self.started >= self.block_time:
+            self.set_ramp(self.ramp_time)
+        self.apply(effects)
+
+    def set_ramp(self, ramp):
+        self.ramp = ramp
+        for control in self.controls.values():
+            control.setTime(ramp)
+
+    def apply(self, effects):
+        # touch only the parameters that changed
+        self.effects = effects
+        for name, control in self.controls.items():
+            if name == 'Volume':
+                value = {True: effects['Volume-param'],
+                         False: 1}[effects['Volume']]
+            else:
+                value = float(effects[name])
+            if value != self.values[name]:
+                self.values[name] = value
+                control.setValue(value)
+                if name in self.effect_objs:
+                    self.switch(name, bool(value))
+
+    def switch(self, name, state):
+        # crossfade through the Interp ramp, stop once the wet side is out
+        effect = self.effect_objs[name]
+        now = time.monotonic()
+        if state and self.running_since[name] is None:
+            if hasattr(effect, 'reset'):
+                effect.reset()
+            effect.play()
+            self.running_since[name] = now
+        elif not state:
+            effect.stop(wait=self.ramp)
+            if self.running_since[name] is not None:
+                self.running_time[name] += now - self.running_since[name]
+                self.running_since[name] = None
+
+    def get_running_time(self, name, now):
+        since = self.running_since[name]
+        if since is None:
+            return self.running_time[name]
+        return self.running_time[name] + now - since
+
+    def stop(self):
+        self.player.stop()
+        for streamer, _ in self.streamers.values():
+            streamer.stop()
+
+    def add_streamer(self, path, channels):
+        streamer = pyo.SfPlayer(str(path), loop=False).stop()
+        mixdown = pyo.Mix(streamer, voices=1, mul=1 / channels)
+        self.streamers[channels] = (streamer, mixdown)
+
+
 class Modulator(HansModule):
-    def __init__(self, main, enable_ai=True):
+    # Effect chain in signal order, overridden by "effects" in the
+    # modulator config. Volume and Speed act on the player, every other
+    # effect is the pyo class named by "type" with the rule output driving
+    # its "param" argument. The range maps the rule output to that param.
+    EFFECTS = [
+        {'name': 'Volume', 'range': [0.4, 1.0]},
+        {'name': 'Speed', 'range': [0.4, 1.6]},
+        {'name': 'Distortion', 'type': 'Disto', 'param': 'drive',
+         'range': [0.4, 1.0], 'args': {'slope': 0.7}},
+        {'name': 'Chorus', 'type': 'Chorus', 'param': 'depth',
+         'range': [1.0, 4.0], 'args': {'bal': 0.6}},
+        {'name': 'Reverb', 'type': 'Freeverb', 'param': 'size',
+         'range': [0.0, 0.6], 'args': {'bal': 0.7}},
+    ]
+
+    def __init__(self, main, enable_ai=True, voices=4, stealing='oldest',
+                 ramp_time=0.05, effects=None, block_time=0):
         self.main = main
         self.enable_ai = enable_ai
         self.chooser = None
-
-        # Effect Chain:
-        # 'Volume' -> 'Speed' -> 'Distortion'
-        # -> 'Chorus' -> 'Reverb' -> 'Pan'
-
-        # Effect parameters:
-        # 'Volume-param': between 0 and 1
-        # 'Speed-param': 1 - original; 0-1 slow; 1< - fast
-        # 'Distortion-param': between 0 and 1
-        # 'Chorus-param': between 0 and 5
-        # 'Reverb-param': between 0 and 1
-
-        self.effect_types = ['Volume', 'Speed', 'Distortion',
-                             'Chorus', 'Reverb']
+        self.seedgen = None
+        self.chain = effects or self.EFFECTS
+        self.effect_types = [e['name'] for e in self.chain]
+        self.switches = [e['name'] for e in self.chain if 'type' in e]
         self.pan_positions = [0.02, 0.25, 0.5, 0.75, 0.98]
         self.effectchain = {}
         for e in self.effect_types:
             self.effectchain[e] = False
             self.effectchain[f'{e}-param'] = 0
 
-        self.player = pyo.TableRead(pyo.NewTable(0.1), loop=False)
         denorm_noise = pyo.Noise(1e-24)
-        self.distortion = pyo.Disto(self.player, slope=0.7)
-        self.sw_distortion = pyo.Interp(self.player, self.distortion, interp=0)
-        self.chorus = pyo.Chorus(self.sw_distortion + denorm_noise, bal=0.6)
-        self.sw_chorus = pyo.Interp(self.sw_distortion, self.chorus, interp=0)
-        self.reverb = pyo.Freeverb(self.sw_chorus + denorm_noise, bal=0.7)
-        self.sw_reverb = pyo.Interp(self.sw_chorus, self.reverb, interp=0)
-        self.output = pyo.Pan(self.sw_reverb, outs=2, spread=0.1)
-        self.output.out()
+        self.voices = [Voice(self.chain, denorm_noise, ramp_time, block_time)
+                       for _ in range(voices)]
+        # the latest voice follows the effect updates while it sounds
+        self.current = None
+        # oldest, quietest or same-category
+        self.stealing = stealing
+        self.steal = getattr(self, f"steal_{stealing.replace('-', '_')}")
+        self.triggers = 0
+        self.steals = 0
+        self.missed = 0
+        self.substituted = 0
 
     def init(self):
         self.chooser = self.main.get_module('chooser')
+        self.seedgen = self.main.get_module('seedgen')
+        self.init_streamers(self.main.get_module('samplebank').samples)
+
+    def init_streamers(self, samples):
+        # triggers run on the audio thread, so every voice gets a player
+        # for each channel count of the streamed samples up front
+        paths = {}
+        for category_samples in samples.values():
+            for sample in category_samples:
+                if sample.streamed:
+                    paths.setdefault(sample.channels, sample.path)
+        for voice in self.voices:
+            for channels, path in paths.items():
+                voice.add_streamer(path, channels)
 
     def execute(self):
         sample = self.chooser.get_output()
         if sample is None:
             return
-        self.player.stop()
-        self.player.setTable(sample.audio)
-        if self.effectchain['Volume']:
-            self.player.setMul(self.effectchain['Volume-param'])
-        freq = sample.audio_rate * {True: self.effectchain['Speed-param'],
-                                    False: 1}[self.effectchain['Speed']]
-        self.player.setFreq(freq)
-        for effect in ('Distortion', 'Chorus', 'Reverb'):
-            sw = getattr(self, f'sw_{effect.lower()}')
-            sw.interp = int(self.effectchain[effect])
-
-        self.output.setPan(random.choice(self.pan_positions))
-        self.player.play()
+        # triggers fire on the audio thread, which never decodes: a table
+        # that is not resident is loaded in the background and a resident
+        # sample of the same category plays instead
+        table = sample.load(wait=False)
+        if table is None and not sample.streamed:
+            sample, table = sample.table_cache.fallback(sample.category)
+            self.substituted += sample is not None
+        if sample is None or (sample.streamed and sample.channels
+                              not in self.voices[0].streamers):
+            # nothing resident yet, or a channel count that only came
+            # with a reload and has no player
+            self.missed += 1
+            return
+        now = time.monotonic()
+        voice = self.get_voice(sample, now)
+        voice.play(sample, table, self.effectchain,
+                   self.seedgen.choice(self.pan_positions), now)
+        self.current = voice
+        self.triggers += 1
+
+    def get_voice(self, sample, now):
+        for voice in self.voices:
+            if voice.ends_at <= now:
+                return voice
+        self.steals += 1
+        return self.steal(sample)
+
+    def steal_oldest(self, sample):
+        return min(self.voices, key=attrgetter('started'))
+
+    def steal_quietest(self, sample):
+        return min(self.voices, key=lambda voice: voice.level.get())
+
+    def steal_same_category(self, sample):
+        same = [v for v in self.voices if v.category == sample.category]
+        return min(same or self.voices, key=attrgetter('started'))
+
+    def get_stats(self):
+        now = time.monotonic()
+        return {'voices': len(self.voices),
+                'active': sum(v.ends_at > now for v in self.voices),
+                'stealing': self.stealing,
+                'triggers': self.triggers,
+                'steals': self.steals,
+                'missed': self.missed,
+                'substituted': self.substituted,
+                'effects': {
+                    name: {'running': sum(v.running_since[name] is not None
+                                          for v in self.voices),
+                           'seconds': sum(v.get_running_time(name, now)
+                                          for v in self.voices)}
+                    for name in self.switches}}
 
     def set_effects(self, new_setup):
         self.effectchain = new_setup
-        self.distortion.setDrive(self.effectchain['Distortion-param'])
-        self.chorus.reset()
-        self.chorus.setDepth(self.effectchain['Chorus-param'])
-        self.reverb.reset()
-        self.reverb.setSize(self.effectchain['Reverb-param'])
+        voice = self.current
+        now = time.monotonic()
+        if voice is not None and voice.ends_at > now:
+            voice.update(new_setup, now)
 
     def toggle_effect(self, name, state):
-        try:
-            self.effectchain[name] = state
-        except KeyError:
-            pass
+        # the chain may be a read-only SigProc snapshot, copy on write
+        if name in self.effectchain:
+            self.effectchain = dict(self.effectchain, **{name: state})
 
     def get_effect_types(self):
         return self.effect_types
+
+    def get_effect_ranges(self):
+        return {e['name']: tuple(e['range']) for e in self.chain}
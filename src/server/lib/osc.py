@@ -0,0 +1,154 @@
+"""
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pyo
+
+
+class Route(object):
+    __slots__ = ('handler', 'count', 'seconds', 'max')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.count = 0
+        self.seconds = 0
+        self.max = 0
+
+
+class OscRouter(object):
+    # Exact OSC addresses mapped to handlers when the server starts, an
+    # unknown address costs a single dict miss.
+
+    def __init__(self, routes=None):
+        self.routes = {}
+        self.rejected = 0
+        for address, handler in (routes or {}).items():
+            self.add(address, handler)
+
+    def add(self, address, handler):
+        self.routes[address] = Route(handler)
+
+    def dispatch(self, address, *args):
+        route = self.routes.get(address)
+        if route is None:
+            self.rejected += 1
+            return False
+        start = time.perf_counter()
+        route.handler(*args)
+        elapsed = time.perf_counter() - start
+        route.count += 1
+        route.seconds += elapsed
+        route.max = max(route.max, elapsed)
+        return True
+
+    def get_stats(self):
+        return {'rejected': self.rejected,
+                'routes': {address: {'count': r.count,
+                                     'seconds': r.seconds,
+                                     'max': r.max}
+                           for address, r in self.routes.items()
+                           if r.count}}
+
+
+class AsyncOscServer(object):
+    # python-osc server on its own asyncio loop, off the audio path.
+    # Control values are coalesced to the latest one per address and,
+    # with the other light messages, handed to the router once per block
+    # on the audio thread. Heavy commands run in a worker thread.
+    HEAVY = ('/hans/cmd/samplereload', '/hans/cmd/rulesreload',
+             '/hans/cmd/cacheprune', '/hans/cmd/samplestats',
+             '/hans/cmd/historydump')
+
+    def __init__(self, router, port, block_time, host='0.0.0.0',
+                 heavy=None):
+        self.router = router
+        self.port = port
+        self.host = host
+        self.block_time = block_time
+        self.heavy = frozenset(heavy or self.HEAVY)
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.batch = deque()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.loop = None
+        self.pattern = None
+        self.received = 0
+        self.coalesced = 0
+        self.offloaded = 0
+
+    def start(self):
+        # optional dependency, only needed for this backend
+        from pythonosc.dispatcher import Dispatcher
+        dispatcher = Dispatcher()
+        dispatcher.set_default_handler(self.receive)
+        threading.Thread(target=self.run, args=(dispatcher,),
+                         daemon=True).start()
+        self.pattern = pyo.Pattern(self.drain, time=self.block_time).play()
+
+    def run(self, dispatcher):
+        from pythonosc.osc_server import AsyncIOOSCUDPServer
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = AsyncIOOSCUDPServer((self.host, self.port), dispatcher,
+                                     self.loop)
+        transport, _ = self.loop.run_until_complete(
+            server.create_serve_endpoint())
+        self.loop.run_forever()
+        transport.close()
+
+    def stop(self):
+        if self.pattern is not None:
+            self.pattern.stop()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+    def receive(self, address, *args):
+        self.received += 1
+        if address in self.heavy:
+            self.offloaded += 1
+            self.loop.run_in_executor(self.executor, self.dispatch,
+                                      address, args)
+        elif address.startswith('/hans/ctrl/'):
+            with self.lock:
+                self.coalesced += address in self.latest
+                self.latest[address] = args
+        else:
+            self.batch.append((address, args))
+
+    def dispatch(self, address, args):
+        self.router.dispatch(address, *args)
+
+    def drain(self):
+        with self.lock:
+            latest, self.latest = self.latest, {}
+        for address, args in latest.items():
+            self.router.dispatch(address, *args)
+        batch = self.batch
+        while batch:
+            address, args = batch.popleft()
+            self.router.dispatch(address, *args)
+
+    def get_stats(self):
+        return {'received': self.received,
+                'coalesced': self.coalesced,
+                'offloaded': self.offloaded}
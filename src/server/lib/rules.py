@@ -0,0 +1,136 @@
+"""
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+
+
+class RuleStage(object):
+    # Outputs of one stage only read values written by earlier stages,
+    # so the whole stage is a single matrix-vector product.
+
+    def __init__(self, state_size, rows, ages):
+        self.targets = numpy.array([r for r, _ in rows], dtype=numpy.intp)
+        self.weights = numpy.zeros((len(rows), state_size))
+        for i, (_, matches) in enumerate(rows):
+            for slot, weight in matches:
+                self.weights[i, slot] += weight
+        denom = numpy.array([sum(w for _, w in m) for _, m in rows])
+        self.nonzero = (denom != 0).astype(float)
+        self.denom = numpy.where(denom != 0, denom, 1)
+        self.values = numpy.zeros(len(rows))
+        self.age_rows = numpy.array([i for i, _, _ in ages],
+                                    dtype=numpy.intp)
+        self.age_first = numpy.array([a for _, a, _ in ages],
+                                     dtype=numpy.intp)
+        self.age_second = numpy.array([a for _, _, a in ages],
+                                      dtype=numpy.intp)
+        self.aged = numpy.zeros(len(ages))
+        self.aged_values = numpy.zeros(len(ages))
+
+    def apply(self, state, decay):
+        numpy.dot(self.weights, state, out=self.values)
+        numpy.divide(self.values, self.denom, out=self.values)
+        numpy.multiply(self.values, self.nonzero, out=self.values)
+        numpy.take(state, self.age_first, out=self.aged)
+        numpy.multiply(self.aged, decay, out=self.aged)
+        numpy.take(self.values, self.age_rows, out=self.aged_values)
+        numpy.put(state, self.targets, self.values)
+        numpy.put(state, self.age_second, self.aged)
+        numpy.put(state, self.age_first, self.aged_values)
+
+
+class RuleEngine(object):
+    # Rules are compiled into weight matrices over a state vector holding
+    # the inputs followed by the outputs. Evaluation gives the same result
+    # as updating the outputs one by one in declaration order: an output
+    # that reads a value updated earlier in the pass goes to a later stage.
+
+    def __init__(self, rules, input_names, output_names, toggle_levels=None,
+                 input_aliases=None, decay=0.5):
+        self.input_names = list(input_names)
+        self.output_names = list(output_names)
+        self.decay = decay
+        offset = len(self.input_names)
+        self.input_index = {n: i for i, n in enumerate(self.input_names)}
+        for alias, name in (input_aliases or {}).items():
+            if name in self.input_index:
+                self.input_index.setdefault(alias, self.input_index[name])
+        self.output_index = {n: offset + i
+                             for i, n in enumerate(self.output_names)}
+        self.state = numpy.zeros(offset + len(self.output_names))
+        self.inputs = self.state[:offset]
+        self.outputs = self.state[offset:]
+        self.stages = self.compile(rules)
+        toggle_levels = toggle_levels or {}
+        self.toggle_names = list(toggle_levels)
+        self.toggle_slots = numpy.array(
+            [self.output_index[n] for n in self.toggle_names],
+            dtype=numpy.intp)
+        self.toggle_levels = numpy.array(list(toggle_levels.values()))
+        self.toggle_values = numpy.zeros(len(self.toggle_names))
+        self.toggles = numpy.zeros(len(self.toggle_names), dtype=bool)
+
+    def compile(self, rules):
+        stage_rows = []
+        last_read, last_write = {}, {}
+        for name in self.output_names:
+            matches = [(index[rule.active], rule.weight)
+                       for rule in rules if rule.inactive == name
+                       for index in (self.input_index, self.output_index)
+                       if rule.active in index]
+            if not matches:
+                continue
+            target = self.output_index[name]
+            reads = {slot for slot, _ in matches}
+            writes = {target}
+            age = None
+            if f'{name}1' in self.output_index and \
+               f'{name}2' in self.output_index:
+                age = (self.output_index[f'{name}1'],
+                       self.output_index[f'{name}2'])
+                reads.add(age[0])
+                writes.update(age)
+            stage = max([last_write.get(s, -1) + 1 for s in reads | writes]
+                        + [last_read.get(s, 0) for s in writes])
+            for slot in reads:
+                last_read[slot] = max(last_read.get(slot, 0), stage)
+            for slot in writes:
+                last_write[slot] = stage
+            while len(stage_rows) <= stage:
+                stage_rows.append(([], []))
+            rows, ages = stage_rows[stage]
+            if age is not None:
+                ages.append((len(rows),) + age)
+            rows.append((target, matches))
+        return [RuleStage(len(self.state), rows, ages)
+                for rows, ages in stage_rows]
+
+    def evaluate(self):
+        for stage in self.stages:
+            stage.apply(self.state, self.decay)
+        numpy.take(self.state, self.toggle_slots, out=self.toggle_values)
+        numpy.greater_equal(self.toggle_values, self.toggle_levels,
+                            out=self.toggles)
+
+    def get(self, name):
+        return float(self.state[self.output_index[name]])
+
+    def load_state(self, other):
+        # carry output history over a rules reload
+        for name, slot in self.output_index.items():
+            if name in other.output_index:
+                self.state[slot] = other.state[other.output_index[name]]
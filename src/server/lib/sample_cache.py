@@ -0,0 +1,143 @@
+"""
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy
+import pyo
+
+from .manifest import read_aiff
+
+
+def resample(data, rate, sample_rate):
+    if round(rate) == sample_rate:
+        return data
+    frames = max(1, round(data.shape[1] * sample_rate / rate))
+    src = numpy.arange(data.shape[1], dtype=numpy.float64)
+    dst = numpy.linspace(0, data.shape[1] - 1, frames)
+    return numpy.stack([numpy.interp(dst, src, chnl)
+                        for chnl in data]).astype(numpy.float32)
+
+
+def save_entry(entry, data):
+    tmp = entry.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, 'wb') as tmp_file:
+        numpy.save(tmp_file, data)
+    os.replace(tmp, entry)
+
+
+def decode_entry(path, entry, sample_rate):
+    # runs in a worker process, no pyo server needed
+    data, rate = read_aiff(path)
+    save_entry(entry, resample(data, rate, sample_rate))
+
+
+class DecodedCache(object):
+    # Decoded audio is stored as float32 .npy files named after the
+    # content hash of the source file and the target sample rate.
+
+    def __init__(self, cache_dir, max_size=2 * 2**30, sample_rate=44100):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.sample_rate = int(sample_rate)
+        self.index_file = self.cache_dir / 'index.json'
+        self.lock = threading.Lock()
+        self.hashes = {}
+        if self.index_file.is_file():
+            with open(self.index_file) as index_file:
+                self.hashes = json.load(index_file)
+
+    def entry(self, path):
+        return self.cache_dir / f'{self.digest(path)}-{self.sample_rate}.npy'
+
+    def warm(self, paths, pool):
+        # decode the missing entries on a process pool, SndTable holds
+        # the GIL while it decodes so threads would only take turns
+        entries = {path: self.entry(path) for path in paths}
+        futures = [pool.submit(decode_entry, path, entry, self.sample_rate)
+                   for path, entry in entries.items()
+                   if not entry.is_file()]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f'Sample decoding failed: {e}')
+
+    def load(self, path):
+        entry = self.entry(path)
+        try:
+            data = numpy.load(entry, mmap_mode='r')
+            os.utime(entry)
+        except (OSError, ValueError):
+            data = self.store(path, entry)
+        table = pyo.DataTable(size=data.shape[1], chnls=data.shape[0])
+        for chnl in range(data.shape[0]):
+            numpy.asarray(table.getBuffer(chnl))[:] = data[chnl]
+        return table, self.sample_rate
+
+    def store(self, path, entry):
+        table = pyo.SndTable(str(path))
+        data = numpy.stack([numpy.asarray(table.getBuffer(chnl))
+                            for chnl in range(len(table))])
+        data = resample(data.astype(numpy.float32),
+                        table.getRate() * table.getSize(), self.sample_rate)
+        save_entry(entry, data)
+        return data
+
+    def digest(self, path):
+        # hash each file once, then only when its mtime or size changes
+        stat = Path(path).stat()
+        signature = [stat.st_mtime_ns, stat.st_size]
+        with self.lock:
+            known = self.hashes.get(str(path))
+        if known is not None and known[:2] == signature:
+            return known[2]
+        blake = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as sample_file:
+            for chunk in iter(lambda: sample_file.read(2**20), b''):
+                blake.update(chunk)
+        with self.lock:
+            self.hashes[str(path)] = signature + [blake.hexdigest()]
+        return blake.hexdigest()
+
+    def flush(self):
+        with self.lock:
+            tmp = self.index_file.with_suffix('.tmp')
+            with open(tmp, 'w') as index_file:
+                json.dump(self.hashes, index_file)
+            os.replace(tmp, self.index_file)
+
+    def prune(self, max_size=None):
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        for entry in self.cache_dir.glob('*.npy'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+        size = sum(e[1] for e in entries)
+        for _, entry_size, entry in entries:
+            if size <= max_size:
+                break
+            entry.unlink()
+            size -= entry_size
+        return size
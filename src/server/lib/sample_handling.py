@@ -15,46 +15,362 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from collections import defaultdict
+import json
+import multiprocessing
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 from pathlib import Path
 import pyo
+from .manifest import SampleManifest
+from .sample_cache import DecodedCache
 
 class Sample(object):
-    __slots__ = ['path', 'category', 'audio', 'audio_rate']
+    __slots__ = ['path', 'category', 'frames', 'channels', 'rate',
+                 'streamed', 'features', 'load_time', 'last_chosen',
+                 'table_cache', 'decoded_cache', '_audio']
 
-    def __init__(self, path, category=None):
+    def __init__(self, path, category=None, table_cache=None,
+                 decoded_cache=None, stream_threshold=None):
         self.path = Path(path)
         self.category = category or self.path.parent.name
-        self.audio = pyo.SndTable(str(self.path))
-        self.audio_rate = self.audio.getRate()
+        self.streamed = False
+        self.features = None
+        self.load_time = 0
+        self.last_chosen = None
+        self.table_cache = table_cache
+        self.decoded_cache = decoded_cache
+        self._audio = None
+        if table_cache is None and stream_threshold is None:
+            self._audio = self.decode()
+            self.channels = len(self._audio)
+        else:
+            info = pyo.sndinfo(str(self.path))
+            self.frames, self.rate, self.channels = info[0], info[2], info[3]
+            if stream_threshold is not None:
+                self.streamed = self.duration > stream_threshold
+            if table_cache is None and not self.streamed:
+                self._audio = self.decode()
+
+    @property
+    def duration(self):
+        return self.frames / self.rate
+
+    @property
+    def audio_rate(self):
+        return self.rate / self.frames
+
+    @property
+    def nbytes(self):
+        # pyo tables hold 32-bit floats
+        return self.frames * self.channels * 4
+
+    @property
+    def resident_bytes(self):
+        return self.nbytes if self._audio is not None else 0
+
+    def decode(self):
+        start = time.perf_counter()
+        if self.decoded_cache is None:
+            table = pyo.SndTable(str(self.path))
+            self.rate = table.getRate() * table.getSize()
+        else:
+            table, self.rate = self.decoded_cache.load(self.path)
+        self.frames = table.getSize()
+        self.load_time = time.perf_counter() - start
+        return table
+
+    def load(self, wait=True):
+        # streamed samples are played from disk and never get a table
+        if self.table_cache is None or self.streamed:
+            return self._audio
+        return self.table_cache.fetch(self, wait)
 
     def __str__(self):
         return "{'Path': f'{self.path.name}', 'Category': f'{self.category}'}"
 
 
+class TableCache(object):
+    def __init__(self, budget):
+        self.budget = budget
+        self.tables = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # resident samples per category, most recently used last
+        self.categories = defaultdict(dict)
+        # decodes requested from the audio thread run here
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        self.pending = set()
+
+    def fetch(self, sample, wait=True):
+        # without wait a miss returns None and the table is decoded on
+        # the loader thread, ready for a later fetch
+        with self.lock:
+            if sample in self.tables:
+                self.touch(sample)
+                self.hits += 1
+                return sample._audio
+            self.misses += 1
+            if not wait:
+                self.request(sample)
+                return None
+        return self.insert(sample)
+
+    def prefetch(self, sample):
+        with self.lock:
+            if sample not in self.tables:
+                self.request(sample)
+
+    def fallback(self, category):
+        # the most recently used resident sample of a category
+        with self.lock:
+            resident = self.categories.get(category)
+            if not resident:
+                return None, None
+            sample = next(reversed(resident))
+            self.touch(sample)
+            return sample, sample._audio
+
+    def has_category(self, category):
+        return bool(self.categories.get(category))
+
+    def request(self, sample):
+        # called with the lock held
+        if sample not in self.pending:
+            self.pending.add(sample)
+            self.loader.submit(self.insert, sample)
+
+    def touch(self, sample):
+        self.tables.move_to_end(sample)
+        resident = self.categories[sample.category]
+        resident[sample] = resident.pop(sample, None)
+
+    def insert(self, sample):
+        try:
+            table = sample.decode()
+        finally:
+            with self.lock:
+                self.pending.discard(sample)
+        with self.lock:
+            sample._audio = table
+            if sample not in self.tables:
+                self.tables[sample] = sample.nbytes
+                self.size += sample.nbytes
+            self.touch(sample)
+            self.evict()
+        return table
+
+    def discard(self, sample):
+        with self.lock:
+            if sample in self.tables:
+                self.size -= self.tables.pop(sample)
+                self.categories[sample.category].pop(sample, None)
+                sample._audio = None
+
+    def evict(self):
+        # the most recently fetched table always stays resident
+        while self.size > self.budget and len(self.tables) > 1:
+            sample, nbytes = self.tables.popitem(last=False)
+            self.categories[sample.category].pop(sample, None)
+            sample._audio = None
+            self.size -= nbytes
+            self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'resident': len(self.tables),
+                    'pending': len(self.pending),
+                    'bytes': self.size,
+                    'budget': self.budget}
+
+
 class SampleBank(object):
-    def __init__(self, sample_root='.'):
+    def __init__(self, sample_root='.', workers=None, progress=None,
+                 lazy=False, memory_budget=256 * 2**20, cache_dir=None,
+                 cache_size=2 * 2**30, sample_rate=44100, manifest=False,
+                 stream_threshold=None, processes=False):
         self.sample_root = sample_root
+        self.workers = workers
+        # decode into the DecodedCache on worker processes before loading
+        self.processes = processes
+        self.progress = progress
+        self.table_cache = TableCache(memory_budget) if lazy else None
+        self.stream_threshold = stream_threshold
+        self.decoded_cache = None
+        if cache_dir:
+            self.decoded_cache = DecodedCache(cache_dir, cache_size,
+                                              sample_rate)
+        self.manifest = None
+        if manifest and Path(sample_root).is_dir():
+            self.manifest = SampleManifest(sample_root, workers)
         self.samples = None
+        self.index = {}
+        self.load_time = 0
+        self.reload_lock = threading.Lock()
+        self.reload_thread = None
+        self.reload_pending = False
         self.reload_samples()
 
     def reload_samples(self):
-        self.init_samples()
-        self.load_samples(self.sample_root)
+        start = time.perf_counter()
+        samples = defaultdict(list)
+        index = self.load_samples(self.sample_root, samples)
+        self.check_num_of_samples(samples)
+        if self.manifest is not None:
+            self.manifest.update(index)
+            for path, (_, sample) in index.items():
+                sample.features = self.manifest.get(path)
+        if self.decoded_cache is not None:
+            self.decoded_cache.flush()
+            self.decoded_cache.prune()
+        for path, (_, sample) in self.index.items():
+            if index.get(path, (None, None))[1] is not sample:
+                self.drop_sample(sample)
+        # swap the new bank in as a whole, readers never see a partial one
+        self.samples, self.index = samples, index
+        self.load_time = time.perf_counter() - start
+
+    def reload_samples_async(self):
+        with self.reload_lock:
+            if self.reload_thread is not None:
+                self.reload_pending = True
+                return
+            self.reload_thread = threading.Thread(target=self.reload_worker,
+                                                  daemon=True)
+            self.reload_thread.start()
 
-    def init_samples(self):
-        self.samples = defaultdict(list)
+    def reload_worker(self):
+        while True:
+            try:
+                self.reload_samples()
+            except Exception as e:
+                print(f'Sample reload failed: {e}')
+            with self.reload_lock:
+                if not self.reload_pending:
+                    self.reload_thread = None
+                    return
+                self.reload_pending = False
 
-    def load_samples(self, sample_root='.'):
+    def load_samples(self, sample_root, samples):
+        index = {}
         if Path(sample_root).is_dir():
-            for sample in Path(sample_root).glob('**/*.aiff'):
-                self.samples[sample.parent.name].append(Sample(sample))
-        self.check_num_of_samples()
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                paths = self.find_samples(pool, Path(sample_root))
+                if (self.processes and self.decoded_cache is not None
+                        and self.table_cache is None):
+                    self.warm_cache(paths)
+                for path, entry in zip(paths,
+                                       self.decode_samples(pool, paths)):
+                    index[path] = entry
+                    samples[entry[1].category].append(entry[1])
+        return index
+
+    def warm_cache(self, paths):
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=ctx) as pool:
+            self.decoded_cache.warm(paths, pool)
+
+    @staticmethod
+    def find_samples(pool, root):
+        # glob each top-level directory in parallel, keep a stable order
+        dirs = sorted(d for d in root.iterdir() if d.is_dir())
+        paths = sorted(root.glob('*.aiff'))
+        for found in pool.map(lambda d: sorted(d.glob('**/*.aiff')), dirs):
+            paths.extend(found)
+        return paths
+
+    def decode_samples(self, pool, paths):
+        index = self.index
+        futures = {pool.submit(self.load_sample, path, index): i
+                   for i, path in enumerate(paths)}
+        entries = [None] * len(paths)
+        for done, future in enumerate(as_completed(futures), 1):
+            entries[futures[future]] = future.result()
+            if self.progress:
+                self.progress(done, len(paths))
+        return entries
 
-    def check_num_of_samples(self):
-        num_of_samples = sum([len(s) for c, s in self.samples.items()])
+    def load_sample(self, path, index):
+        stat = path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        known = index.get(path)
+        if known is not None and known[0] == signature:
+            return known
+        return signature, Sample(path, table_cache=self.table_cache,
+                                 decoded_cache=self.decoded_cache,
+                                 stream_threshold=self.stream_threshold)
+
+    def drop_sample(self, sample):
+        if self.table_cache is not None:
+            self.table_cache.discard(sample)
+
+    def check_num_of_samples(self, samples=None):
+        if samples is None:
+            samples = self.samples
+        num_of_samples = sum([len(s) for c, s in samples.items()])
         if num_of_samples < 1:
             raise Exception("No samples are available!")
 
     def get_categories(self):
         return self.samples.keys()
+
+    def prefetch(self, categories):
+        # lazy mode: request a table for every category that has none
+        # resident, a trigger that misses plays one of those instead
+        if self.table_cache is None:
+            return
+        samples = self.samples
+        for category in categories:
+            members = samples.get(category)
+            if members and not self.table_cache.has_category(category):
+                self.table_cache.prefetch(members[0])
+
+    def prune_cache(self, max_size=None):
+        if self.decoded_cache is None:
+            return None
+        return self.decoded_cache.prune(max_size)
+
+    def get_cache_stats(self):
+        if self.table_cache is None:
+            return None
+        return self.table_cache.get_stats()
+
+    def get_stats(self):
+        samples, categories = [], {}
+        for category, category_samples in self.samples.items():
+            stats = [{'path': str(s.path),
+                      'bytes': s.resident_bytes,
+                      'frames': s.frames,
+                      'streamed': s.streamed,
+                      'load_time': s.load_time,
+                      'last_chosen': s.last_chosen}
+                     for s in category_samples]
+            chosen = [s['last_chosen'] for s in stats if s['last_chosen']]
+            categories[category] = {
+                'samples': len(stats),
+                'bytes': sum(s['bytes'] for s in stats),
+                'frames': sum(s['frames'] for s in stats),
+                'load_time': sum(s['load_time'] for s in stats),
+                'last_chosen': max(chosen, default=None)}
+            samples += [dict(s, category=category) for s in stats]
+        return {'load_time': self.load_time,
+                'cache': self.get_cache_stats(),
+                'categories': categories,
+                'samples': samples}
+
+    def dump_stats(self, path=None):
+        stats = json.dumps(self.get_stats(), indent=2)
+        if path is None:
+            print(stats)
+        else:
+            with open(path, 'w') as stats_file:
+                stats_file.write(stats)
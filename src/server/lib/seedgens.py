@@ -16,10 +16,29 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import random
+import threading
+from array import array
 from .module_base import HansModule
 
 
-class BasicSeedGen(HansModule):
+class SeedGenBase(HansModule):
+    # All randomness of the server goes through the seedgen, every
+    # helper is built on draw(), a 32 bit integer.
+
+    def draw(self):
+        raise NotImplementedError
+
+    def random(self):
+        return self.draw() / 2 ** 32
+
+    def choice(self, seq):
+        return seq[self.draw() % len(seq)]
+
+    def randrange(self, start, stop):
+        return start + self.draw() % (stop - start)
+
+
+class BasicSeedGen(SeedGenBase):
     def __init__(self, main):
         self.output = self.execute()
 
@@ -30,11 +49,66 @@ class BasicSeedGen(HansModule):
         self.execute()
         return self.output
 
+    def draw(self):
+        return random.getrandbits(32)
+
+
+class SeededSeedGen(SeedGenBase):
+    # Owns its PRNG stream. Every draw can be recorded to a file of
+    # 32 bit words and replayed from it; once a replay runs out the
+    # seeded stream takes over.
+
+    def __init__(self, main, seed=None, record=None, replay=None):
+        self.main = main
+        self.rng = random.Random(seed)
+        self.record = record
+        self.recorded = array('I')
+        self.replayed = array('I')
+        self.replay_pos = 0
+        self.lock = threading.Lock()
+        if replay:
+            with open(replay, 'rb') as rfile:
+                self.replayed.frombytes(rfile.read())
+        self.output = None
+
+    def draw(self):
+        with self.lock:
+            if self.replay_pos < len(self.replayed):
+                value = self.replayed[self.replay_pos]
+                self.replay_pos += 1
+            else:
+                value = self.rng.getrandbits(32)
+            if self.record:
+                self.recorded.append(value)
+        return value
+
+    def execute(self):
+        self.output = self.draw() % 13579
+
+    def get_output(self):
+        self.execute()
+        return self.output
+
+    def terminate(self):
+        self.save()
+
+    def save(self, path=None):
+        path = path or self.record
+        if path:
+            with self.lock, open(path, 'wb') as rfile:
+                self.recorded.tofile(rfile)
+
+
+class DummySeedGen(SeedGenBase):
+    # only the sample index is fixed, trigger probabilities, solos and
+    # panning stay random as with the global generator before
 
-class DummySeedGen(HansModule):
     def __init__(self, main):
         self.main = main
         self.output = 4
 
     def execute(self):
         pass
+
+    def draw(self):
+        return random.getrandbits(32)
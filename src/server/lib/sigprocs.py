@@ -19,79 +19,245 @@ import re
 import threading
 import time
 from collections import namedtuple
+from types import MappingProxyType
 
 import pyo
 
+from .analysers import AnalyserHistory, SpectralAnalyser, build_analyser
 from .module_base import HansModule
+from .rules import RuleEngine
+
+
+class TickTimer(object):
+    # Deadline bookkeeping for a periodic task. Deadlines advance by whole
+    # intervals, so the schedule does not drift with execution time.
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.deadline = None
+        self.started_at = 0
+        self.ticks = 0
+        self.overruns = 0
+        self.jitter_sum = 0
+        self.jitter_max = 0
+        self.busy_sum = 0
+        self.busy_max = 0
+
+    def start(self, now):
+        if self.deadline is None:
+            self.deadline = now
+        lateness = now - self.deadline
+        if lateness >= self.interval:
+            # missed whole periods, count them and catch up
+            missed = int(lateness // self.interval)
+            self.overruns += missed
+            self.deadline += missed * self.interval
+            lateness -= missed * self.interval
+        jitter = abs(lateness)
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.ticks += 1
+        self.started_at = now
+        self.deadline += self.interval
+
+    def finish(self, now):
+        busy = now - self.started_at
+        self.busy_sum += busy
+        self.busy_max = max(self.busy_max, busy)
+
+    def set_interval(self, interval):
+        self.interval = interval
+        self.deadline = None
+
+    def get_stats(self):
+        ticks = max(self.ticks, 1)
+        return {'interval': self.interval,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'jitter_mean': self.jitter_sum / ticks,
+                'jitter_max': self.jitter_max,
+                'busy_mean': self.busy_sum / ticks,
+                'busy_max': self.busy_max}
 
 
 class SigProc(HansModule):
     Rule = namedtuple('Rule', ['active', 'inactive', 'weight'])
     Analyser = namedtuple('Analyser', ['module', 'limit'])
+    # Published by reference swap, readers never see a partial update
+    Snapshot = namedtuple('Snapshot', ['version', 'effects', 'samples',
+                                       'categories', 'scores'])
+    LIMITS = {'yin': 400, 'cen': 6000, 'rms': 0.6, 'amp': 0.8,
+              'flux': 0.5, 'flat': 1.0, 'ons': 8.0}
 
     def __init__(self, main, audioin, rules_file='hans.rules',
-                 update_interval=0.5):
+                 update_interval=0.5, clock='thread', spectral=False,
+                 history_seconds=None, history_window=1.0,
+                 history_period=None, channels=None, analysers=None):
         self.main = main
         self.rules_file = rules_file
         self.audioin = audioin
+        # input channel numbers, used to qualify names as yin@2
+        self.channels = channels or [0]
+        self.input_names = None
         self.update_interval = update_interval
+        self.clock = clock
+        self.spectral = spectral
+        self.spectral_stage = None
+        # per-analyser constructor arguments, lowpass and downsample
+        self.analyser_settings = analysers or {}
+        self.history_seconds = history_seconds
+        self.history_window = history_window
+        self.history_period = history_period
+        self.history = None
+        self.timer = TickTimer(update_interval)
+        self.pattern = None
         self._terminate = False
         self.modulator = None
+        self.chooser = None
         self.analysers = None
-        self.inputlist = None
-        self.outputlist = None
         self.rulelist = None
         self.toggle_levels = None
-        self.output = None
+        self.engine = None
+        self.effect_ranges = None
+        self.output = self.Snapshot(0, MappingProxyType({}),
+                                    MappingProxyType({}), (),
+                                    MappingProxyType({}))
 
     def init(self):
         self.set_rules_toggle_levels(self.rules_file)
         self.init_analysers(self.audioin)
+        self.init_history(self.audioin)
+        self.compile_rules()
         self.set_inputlist()
-        self.init_outputlist()
         self.modulator = self.main.get_module('modulator')
-        threading.Thread(target=self.run).start()
+        self.chooser = self.main.get_module('chooser')
+        if self.clock == 'server':
+            # pyo counts the period in samples on the audio thread
+            self.pattern = pyo.Pattern(self.tick,
+                                       time=self.update_interval).play()
+        else:
+            threading.Thread(target=self.run).start()
 
     def init_analysers(self, audioin):
-        self.analysers = {'yin': self.Analyser(pyo.Yin(audioin), 400),
-                          'cen': self.Analyser(pyo.Centroid(audioin), 6000),
-                          'rms': self.Analyser(pyo.Follower(audioin), 0.6),
-                          'amp': self.Analyser(pyo.PeakAmp(audioin), 0.8)}
+        # every analyser is a single multichannel pyo object
+        modules = {'yin': self.build_analyser('yin', pyo.Yin, audioin),
+                   'cen': None,
+                   'rms': self.build_analyser('rms', pyo.Follower, audioin),
+                   'amp': self.build_analyser('amp', pyo.PeakAmp, audioin)}
+        if self.spectral:
+            # every spectral feature comes from one shared FFT
+            stage = self.spectral_stage = self.build_analyser(
+                'spectral', SpectralAnalyser, audioin)
+            modules.update({f: stage.feature(f)
+                            for f in SpectralAnalyser.FEATURES})
+        else:
+            modules['cen'] = self.build_analyser('cen', pyo.Centroid,
+                                                 audioin)
+        self.analysers = {name: self.Analyser(module, self.LIMITS[name])
+                          for name, module in modules.items()}
+        self.input_names = [self.channel_name(name, chnl)
+                            for name in self.analysers
+                            for chnl in self.channels]
+
+    def build_analyser(self, name, module, audioin):
+        return build_analyser(module, audioin,
+                              **self.analyser_settings.get(name, {}))
+
+    def channel_name(self, name, chnl):
+        # the first channel also answers to the plain analyser name
+        if chnl == self.channels[0]:
+            return name
+        return f'{name}@{chnl}'
+
+    def get_input_aliases(self):
+        # yin@<first channel> is the same input as yin
+        suffixes = [''] + [f'_{stat}' for stat in AnalyserHistory.STATS]
+        first = self.channels[0]
+        return {f'{name}@{first}{suffix}': f'{name}{suffix}'
+                for name in self.analysers for suffix in suffixes}
+
+    def init_history(self, audioin):
+        if not self.history_seconds:
+            return
+        # capture at control rate, once per audio block by default
+        period = self.history_period or (audioin.getBufferSize()
+                                         / audioin.getSamplingRate())
+        self.history = AnalyserHistory(self.analysers, self.input_names,
+                                       self.history_seconds, period,
+                                       self.history_window)
+
+    def get_input_names(self):
+        if self.history is None:
+            return self.input_names
+        return self.history.get_input_names()
+
+    def export_history(self, path):
+        if self.history is not None:
+            self.history.export(path)
 
     def run(self):
         while not self._terminate:
+            self.timer.start(time.perf_counter())
             self.execute()
-            time.sleep(self.update_interval)
+            self.chooser.update(self.output)
+            self.timer.finish(time.perf_counter())
+            time.sleep(max(0, self.timer.deadline - time.perf_counter()))
             if self.modulator.enable_ai:
-                self.modulator.set_effects(self.output['effects'])
+                self.modulator.set_effects(self.output.effects)
+
+    def tick(self):
+        self.timer.start(time.perf_counter())
+        self.execute()
+        self.chooser.update(self.output)
+        if self.modulator.enable_ai:
+            self.modulator.set_effects(self.output.effects)
+        self.timer.finish(time.perf_counter())
 
     def terminate(self):
         self._terminate = True
-        time.sleep(self.update_interval)
+        if self.pattern is not None:
+            self.pattern.stop()
+        else:
+            time.sleep(self.update_interval)
+
+    def set_update_interval(self, update_interval):
+        self.update_interval = update_interval
+        self.timer.set_interval(update_interval)
+        if self.pattern is not None:
+            self.pattern.setTime(update_interval)
+
+    def get_timing_stats(self):
+        return dict(self.timer.get_stats(), clock=self.clock)
 
     def execute(self):
-        sample_categories = self.main.get_sample_categories()
-        self.set_inputlist()
-        self.calcout()
-        effect_conf = {
-            'Volume-param': self.denorm(self.outputlist['Volume'], 0.4, 1.0),
-            'Speed-param': self.denorm(self.outputlist['Speed'], 0.4, 1.6),
-            'Distortion-param': self.denorm(self.outputlist['Distortion'], 0.4, 1.0),
-            'Chorus-param': self.denorm(self.outputlist['Chorus'], 1.0, 4.0),
-            'Reverb-param': self.denorm(self.outputlist['Reverb'], 0.0, 0.6),
-        }
-        effect_conf.update({cat: self.toggle(self.outputlist[cat],
-                                             self.toggle_levels[cat])
+        engine = self.engine
+        self.set_inputlist(engine)
+        engine.evaluate()
+        effect_conf = {f'{effect}-param': self.denorm(engine.get(effect),
+                                                      *limits)
+                       for effect, limits in self.effect_ranges.items()}
+        toggles = dict(zip(engine.toggle_names, engine.toggles.tolist()))
+        effect_conf.update({cat: toggles.pop(cat)
                             for cat in self.main.get_effect_types()})
-        sample_cats = {cat: self.toggle(self.outputlist[cat],
-                                        self.toggle_levels[cat])
-                       for cat in sample_categories}
-        self.output = {'effects': effect_conf, 'samples': sample_cats}
+        categories = tuple(c for c, v in toggles.items() if v)
+        # continuous category scores, for weighted choosers
+        scores = {c: engine.get(c) for c in toggles}
+        self.output = self.Snapshot(self.output.version + 1,
+                                    MappingProxyType(effect_conf),
+                                    MappingProxyType(toggles), categories,
+                                    MappingProxyType(scores))
 
-    def set_inputlist(self):
-        self.inputlist = {name: self.norm(analyser.module.get(),
-                                          0, analyser.limit)
-                          for name, analyser in self.analysers.items()}
+    def set_inputlist(self, engine=None):
+        engine = engine or self.engine
+        if self.history is not None:
+            self.history.read(engine.inputs)
+            return
+        streams = len(self.channels)
+        for i, analyser in enumerate(self.analysers.values()):
+            values = analyser.module.get(all=True)
+            for j in range(streams):
+                engine.inputs[i * streams + j] = self.norm(values[j], 0,
+                                                           analyser.limit)
 
     def set_inputlim(self, name, value):
         setattr(self, f'{name}lim', value)
@@ -105,10 +271,28 @@ class SigProc(HansModule):
         self.load_rules(self.rules_file)
         self.toggle_levels = {}
         self.load_toggle_levels(self.rules_file)
+        if self.analysers is not None:
+            self.compile_rules()
+
+    def compile_rules(self):
+        sample_categories = list(self.main.get_sample_categories())
+        effect_types = list(self.main.get_effect_types())
+        # denormalisation ranges of the declared effect chain
+        self.effect_ranges = self.main.get_effect_ranges()
+        outputs = sample_categories + [f'{c}{i}' for c in effect_types
+                                       for i in ('', '1', '2')]
+        toggle_levels = {c: self.toggle_levels[c]
+                         for c in sample_categories + effect_types}
+        engine = RuleEngine(self.rulelist, self.get_input_names(), outputs,
+                            toggle_levels, self.get_input_aliases())
+        if self.engine is not None:
+            engine.load_state(self.engine)
+        # swap in one step, the control thread may be executing
+        self.engine = engine
 
     def load_rules(self, rules_file):
         # active | inactive : weight
-        regex = r"^\s*(\w+)\s*\|\s*(\w+)\s*\:\s*([-+]?\d*\.\d+|\d)"
+        regex = r"^\s*([\w@]+)\s*\|\s*(\w+)\s*\:\s*([-+]?\d*\.\d+|\d)"
         pattern = re.compile(regex)
         with open(rules_file) as rfile:
             for line in rfile:
@@ -127,32 +311,6 @@ class SigProc(HansModule):
                 for cap in caps:
                     self.toggle_levels[cap[0]] = float(cap[1])
 
-    def init_outputlist(self):
-        self.outputlist = {cat: 0
-                           for cat in self.main.get_sample_categories()}
-        self.outputlist.update({f'{c}{i}': 0
-                                for c in self.main.get_effect_types()
-                                for i in ('', '1', '2')})
-
-    def calcout(self):
-        for output_name in self.outputlist:
-            tmplist = []
-            for rule in self.rulelist:
-                if output_name == rule.inactive:
-                    for rlist in (self.inputlist, self.outputlist):
-                        tmplist += [(rlist[name], rule.weight)
-                                    for name in rlist if name == rule.active]
-            if tmplist:
-                self.outputlist[output_name] = self.calcavg(tmplist)
-                self.age(output_name)
-
-    def age(self, key):
-        try:
-            self.outputlist[f'{key}2'] = 0.5 * self.outputlist[f'{key}1']
-            self.outputlist[f'{key}1'] = self.outputlist[key]
-        except KeyError:
-            pass
-
     @staticmethod
     def norm(variable, min, max):
         if min < variable < max:
@@ -166,16 +324,3 @@ class SigProc(HansModule):
         if variable:
             return variable * (max - min) + min
         return 0
-
-    @staticmethod
-    def calcavg(tuplelist):
-        numerator = sum([l[0] * l[1] for l in tuplelist])
-        denominator = sum([l[1] for l in tuplelist])
-        try:
-            return numerator / denominator
-        except ZeroDivisionError:
-            return 0
-
-    @staticmethod
-    def toggle(variable, limit):
-        return variable >= limit
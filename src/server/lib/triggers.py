@@ -0,0 +1,223 @@
+"""
+Copyright (C) 2015-     Tamás Lévai    <levait@tmit.bme.hu>
+Copyright (C) 2015-     Richárd Beregi <richard.beregi@sztaki.mta.hu>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+import pyo
+
+from .module_base import HansModule
+
+
+class TriggerScheduler(HansModule):
+    # OSC callbacks, solos and quantised triggers only append a timestamp
+    # to a deque, the triggers are sorted into a heap and fired on the
+    # audio thread at the block boundary nearest to their due time.
+
+    def __init__(self, main, block_time, period=None, tempo=None,
+                 division=4, max_solos=1):
+        self.main = main
+        # drain period, one audio block by default
+        self.period = period or block_time
+        # optional quantisation grid: division steps per beat at tempo bpm
+        self.grid = 60 / tempo / division if tempo else None
+        self.origin = time.perf_counter()
+        self.pending = deque()
+        self.heap = []
+        self.sequence = itertools.count()
+        self.modulator = None
+        self.pattern = None
+        # solo id -> [events left, cancelled]
+        self.solos = {}
+        self.solo_ids = itertools.count(1)
+        self.solo_lock = threading.Lock()
+        self.max_solos = max_solos
+        self.fired = 0
+        self.direct = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+        self.jitter_sum = 0
+        self.jitter_max = 0
+
+    def init(self):
+        self.modulator = self.main.get_module('modulator')
+        self.pattern = pyo.Pattern(self.drain, time=self.period).play()
+
+    def terminate(self):
+        if self.pattern is not None:
+            self.pattern.stop()
+
+    def push(self, delay=0.0, action=None, solo=None):
+        # safe from any thread, deque.append is atomic; action defaults
+        # to triggering the modulator
+        requested = time.perf_counter() + delay
+        self.pending.append((requested, action, solo))
+
+    def fire(self):
+        # for callbacks already on the audio thread, like RawMidi at the
+        # start of a block: without a grid the queue would only delay the
+        # trigger to the next drain
+        if self.grid is not None:
+            self.push()
+            return
+        self.modulator.execute()
+        self.direct += 1
+
+    def start_solo(self, delays, action):
+        # every event is queued up front, None if max_solos are playing
+        with self.solo_lock:
+            playing = sum(not cancelled for _, cancelled in
+                          self.solos.values())
+            if playing >= self.max_solos or not delays:
+                return None
+            solo = next(self.solo_ids)
+            self.solos[solo] = [len(delays), False]
+        for delay in delays:
+            self.push(delay, action, solo)
+        return solo
+
+    def cancel_solo(self, solo=None):
+        # the queued events are dropped when they fall due
+        with self.solo_lock:
+            for key, state in self.solos.items():
+                if solo is None or key == solo:
+                    state[1] = True
+
+    def solo_event(self, solo):
+        with self.solo_lock:
+            state = self.solos[solo]
+            state[0] -= 1
+            if not state[0]:
+                del self.solos[solo]
+            return not state[1]
+
+    def set_tempo(self, tempo, division=4):
+        self.grid = 60 / tempo / division if tempo else None
+        self.origin = time.perf_counter()
+
+    def quantize(self, due):
+        if self.grid is None:
+            return due
+        steps = math.ceil((due - self.origin) / self.grid)
+        return self.origin + steps * self.grid
+
+    def drain(self):
+        pending, heap = self.pending, self.heap
+        while pending:
+            requested, action, solo = pending.popleft()
+            heapq.heappush(heap, (self.quantize(requested),
+                                  next(self.sequence), requested, action,
+                                  solo))
+        # fire what falls due before the middle of the next block
+        now = time.perf_counter()
+        horizon = now + self.period / 2
+        while heap and heap[0][0] <= horizon:
+            due, _, requested, action, solo = heapq.heappop(heap)
+            if solo is not None and not self.solo_event(solo):
+                continue
+            (action or self.modulator.execute)()
+            self.record(now, due, requested)
+
+    def record(self, now, due, requested):
+        latency = now - requested
+        jitter = abs(now - due)
+        self.fired += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def get_stats(self):
+        fired = max(self.fired, 1)
+        return {'period': self.period,
+                'grid': self.grid,
+                'fired': self.fired,
+                'direct': self.direct,
+                'queued': len(self.pending) + len(self.heap),
+                'solos': len(self.solos),
+                'latency_mean': self.latency_sum / fired,
+                'latency_max': self.latency_max,
+                'jitter_mean': self.jitter_sum / fired,
+                'jitter_max': self.jitter_max}
+
+
+class TriggerTable(object):
+    # MIDI note-on filter compiled into 128-entry arrays: a note fires
+    # above its velocity threshold with its probability, not sooner than
+    # its retrigger interval, and only while the global token bucket
+    # holds a token.
+    NOTES = [
+        # accented bass drum
+        {'notes': [35, 36], 'velocity': 64, 'probability': 0.5},
+        # accented snare
+        {'notes': [38, 40], 'velocity': 70, 'probability': 0.25},
+        # accented toms
+        {'notes': [41, 45, 48, 50], 'velocity': 70, 'probability': 0.15},
+        # accented cymbals
+        {'notes': [49, 51, 55, 57, 59], 'velocity': 70, 'probability': 0.1},
+    ]
+
+    def __init__(self, notes=None, budget=None):
+        # velocities never exceed 127, unmapped notes never fire
+        self.velocity = array('i', [127] * 128)
+        self.probability = array('d', [0] * 128)
+        self.interval = array('d', [0] * 128)
+        self.last = array('d', [-math.inf] * 128)
+        self.fired = array('I', [0] * 128)
+        for entry in notes or self.NOTES:
+            for note in entry['notes']:
+                self.velocity[note] = entry['velocity']
+                self.probability[note] = entry['probability']
+                self.interval[note] = entry.get('interval', 0)
+        # budget: {'rate': tokens per second, 'burst': bucket size}
+        self.rate = budget['rate'] if budget else None
+        self.burst = budget.get('burst', 1) if budget else 0
+        self.tokens = self.burst
+        self.refilled = -math.inf
+        self.limited = 0
+        self.over_budget = 0
+
+    def accept(self, note, velocity, now, random):
+        note &= 127
+        if velocity <= self.velocity[note]:
+            return False
+        if now - self.last[note] < self.interval[note]:
+            self.limited += 1
+            return False
+        if random() >= self.probability[note]:
+            return False
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens
+                              + (now - self.refilled) * self.rate)
+            self.refilled = now
+            if self.tokens < 1:
+                self.over_budget += 1
+                return False
+            self.tokens -= 1
+        self.last[note] = now
+        self.fired[note] += 1
+        return True
+
+    def get_stats(self):
+        return {'fired': {n: c for n, c in enumerate(self.fired) if c},
+                'limited': self.limited,
+                'over_budget': self.over_budget}